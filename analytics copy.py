@@ -0,0 +1,299 @@
+import threading
+from decimal import Decimal
+from itertools import islice
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import F, IntegerField, Value
+from django.db.models.functions import Cast, Coalesce, Round
+
+from records.models import (
+    ABSENCE,
+    ATTENDED_CATEGORIES,
+    SUCCESSFUL,
+    Client,
+    Referral,
+    Service,
+    search_version,
+)
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; without it the analytics are unavailable
+    np = None
+
+# Rows converted to arrays at a time while loading
+LOAD_CHUNK_SIZE = 10000
+
+# Stored in date columns for a missing date
+NO_DATE = -(2**31)
+
+
+def available():
+    return np is not None
+
+
+def cents(field):
+    """A money column as integer cents, computed by the database, 0 when blank"""
+    return Coalesce(
+        Cast(Round(F(field) * Value(Decimal(100))), IntegerField()), Value(0)
+    )
+
+
+class Encoder:
+    """
+    Assigns integer codes to the distinct values of a categorical column. Codes are
+    int32, so columns with more than 32767 distinct values (e.g. agencies) fit.
+    """
+
+    def __init__(self):
+        self.codes = {}
+
+    def __call__(self, values):
+        codes = self.codes
+        return np.fromiter(
+            (codes.setdefault(value, len(codes)) for value in values),
+            dtype=np.int32,
+            count=len(values),
+        )
+
+    @property
+    def labels(self):
+        return list(self.codes)
+
+
+def to_days(values):
+    """Dates as int32 days since 1970-01-01, NO_DATE where missing"""
+    dates = np.array(values, dtype="datetime64[D]")
+    days = dates.astype(np.int64)
+    days[np.isnat(dates)] = NO_DATE
+    return days.astype(np.int32)
+
+
+def to_array(dtype):
+    return lambda values: np.fromiter(values, dtype=dtype, count=len(values))
+
+
+def load_columns(queryset, columns):
+    """
+    Streams a queryset into one array per column. columns maps each column name to
+    (queryset field or expression, converter from a chunk of values to an array).
+    """
+    fields = {}
+    for name, (field, _) in columns.items():
+        if not isinstance(field, str):
+            field, expression = f"snapshot_{name}", field
+            queryset = queryset.annotate(**{field: expression})
+        fields[name] = field
+    rows = queryset.values_list(*fields.values()).iterator(chunk_size=LOAD_CHUNK_SIZE)
+    chunks = {name: [] for name in columns}
+    while chunk := list(islice(rows, LOAD_CHUNK_SIZE)):
+        for name, values in zip(columns, zip(*chunk)):
+            chunks[name].append(columns[name][1](values))
+    return {
+        name: np.concatenate(arrays) if arrays else columns[name][1](())
+        for name, arrays in chunks.items()
+    }
+
+
+def group_sum(codes, values, size, mask=None):
+    """Sums values for each code from 0 to size - 1"""
+    if mask is not None:
+        codes, values = codes[mask], values[mask]
+    return np.bincount(codes, weights=values, minlength=size)
+
+
+def group_count(codes, size, mask=None):
+    """Counts the rows with each code from 0 to size - 1"""
+    if mask is not None:
+        codes = codes[mask]
+    return np.bincount(codes, minlength=size)
+
+
+def group_median(codes, values, size, mask=None):
+    """The median of the values with each code, NaN for codes without any"""
+    if mask is not None:
+        codes, values = codes[mask], values[mask]
+    order = np.lexsort((values, codes))
+    codes, values = codes[order], values[order]
+    starts = np.searchsorted(codes, np.arange(size), side="left")
+    ends = np.searchsorted(codes, np.arange(size), side="right")
+    medians = np.full(size, np.nan)
+    for code in np.flatnonzero(ends > starts):
+        medians[code] = np.median(values[starts[code] : ends[code]])
+    return medians
+
+
+def dollars(amount):
+    return Decimal(int(round(amount))) / 100
+
+
+class LedgerSnapshot:
+    """
+    The live clients, services and referral links as NumPy column arrays, loaded in
+    one pass so a dashboard can answer many questions without touching the ORM.
+
+    clients, services and referrals are dicts of equal-length arrays. Categorical
+    columns hold codes into labels[column]; money is integer cents and dates are
+    days since 1970-01-01. Each service and referral link also carries "client",
+    the position of its client in the client arrays.
+    """
+
+    def __init__(self, version, clients, services, referrals, labels):
+        self.version = version
+        self.clients = clients
+        self.services = services
+        self.referrals = referrals
+        self.labels = labels
+
+    @classmethod
+    def load(cls, version):
+        locations = Encoder()
+        statuses = Encoder()
+        descs = Encoder()
+        agencies = Encoder()
+        clients = load_columns(
+            Client.objects.order_by("pk"),
+            {
+                "id": ("pk", to_array(np.int32)),
+                "location": ("primary_location", locations),
+                "status": ("current_status", statuses),
+                "dcs": ("dcs", to_array(np.bool_)),
+                "enrolled": ("date_enroll", to_days),
+                "discharged": ("date_discharge", to_days),
+            },
+        )
+        services = load_columns(
+            Service.objects.filter(client__deleted=False).order_by(),
+            {
+                "client_id": ("client_id", to_array(np.int32)),
+                "date": ("date", to_days),
+                "desc": ("desc", descs),
+                "category": ("category", to_array(np.int8)),
+                "fee": (cents("fee"), to_array(np.int64)),
+                "discount": (cents("discount"), to_array(np.int64)),
+                "payment": (cents("payment"), to_array(np.int64)),
+                "credit": (Coalesce("credit", Value(0)), to_array(np.int32)),
+            },
+        )
+        referrals = load_columns(
+            Referral.clients.through.objects.filter(
+                referral__deleted=False, client__deleted=False
+            ).order_by(),
+            {
+                "client_id": ("client_id", to_array(np.int32)),
+                "agency": ("referral__agency", agencies),
+            },
+        )
+        # Client ids are sorted, so positions come from one vectorized search
+        for table in (services, referrals):
+            table["client"] = np.searchsorted(clients["id"], table["client_id"])
+        services["location"] = clients["location"][services["client"]]
+        labels = {
+            "location": locations.labels,
+            "status": statuses.labels,
+            "desc": descs.labels,
+            "agency": agencies.labels,
+        }
+        return cls(version, clients, services, referrals, labels)
+
+    def __len__(self):
+        return len(self.services["date"])
+
+    def balances_by_location(self):
+        """Discounts plus payments less fees over every service, per location"""
+        services = self.services
+        size = len(self.labels["location"])
+        balance = services["discount"] + services["payment"] - services["fee"]
+        totals = group_sum(services["location"], balance, size)
+        return {
+            location: dollars(total)
+            for location, total in zip(self.labels["location"], totals)
+        }
+
+    def absence_rates_by_agency(self):
+        """
+        (absences, classes attended or missed, absence rate) of the clients each
+        agency referred, with a rate of None for agencies whose clients have neither
+        """
+        services = self.services
+        size = len(self.clients["id"])
+        absences = group_count(
+            services["client"], size, services["category"] == ABSENCE
+        )
+        attended = group_count(
+            services["client"],
+            size,
+            np.isin(services["category"], ATTENDED_CATEGORIES),
+        )
+        links = self.referrals
+        agencies = len(self.labels["agency"])
+        agency_absences = group_sum(
+            links["agency"], absences[links["client"]], agencies
+        )
+        agency_classes = agency_absences + group_sum(
+            links["agency"], attended[links["client"]], agencies
+        )
+        return {
+            agency: (
+                int(absent),
+                int(classes),
+                float(absent / classes) if classes else None,
+            )
+            for agency, absent, classes in zip(
+                self.labels["agency"], agency_absences, agency_classes
+            )
+        }
+
+    def completion_days(self, status=SUCCESSFUL):
+        """
+        (clients, median days, mean days) from enrollment to discharge, per location,
+        for clients with the given status and both dates
+        """
+        clients = self.clients
+        size = len(self.labels["location"])
+        if status not in self.labels["status"]:
+            return {}
+        mask = (
+            (clients["status"] == self.labels["status"].index(status))
+            & (clients["enrolled"] != NO_DATE)
+            & (clients["discharged"] != NO_DATE)
+        )
+        days = (clients["discharged"] - clients["enrolled"]).astype(np.float64)
+        counts = group_count(clients["location"], size, mask)
+        totals = group_sum(clients["location"], days, size, mask)
+        medians = group_median(clients["location"], days, size, mask)
+        return {
+            location: (int(count), float(median), float(total / count))
+            for location, count, median, total in zip(
+                self.labels["location"], counts, medians, totals
+            )
+            if count
+        }
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def ledger_version():
+    """Changes whenever a client, service or referral (or its client links) changes"""
+    return tuple(
+        search_version(model)
+        for model in (Client, Service, Referral, Referral.clients.through)
+    )
+
+
+def ledger_snapshot():
+    """
+    This process's LedgerSnapshot, reloaded only when the ledger has changed since
+    it was taken. The version is read before loading, so a change made during the
+    load triggers another one next time rather than being missed.
+    """
+    global _snapshot
+    if np is None:
+        raise ImproperlyConfigured("Ledger analytics require NumPy to be installed.")
+    version = ledger_version()
+    with _snapshot_lock:
+        if _snapshot is None or _snapshot.version != version:
+            _snapshot = LedgerSnapshot.load(version)
+        return _snapshot
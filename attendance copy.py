@@ -0,0 +1,72 @@
+from django.db import transaction
+
+from records.models import CaseNote, Service, bulk_saved
+
+# Roster outcomes: (label, service description, DCS client description, credits used)
+ATTENDANCE_OUTCOMES = {
+    "attended": (
+        "Attended",
+        "Attended Class Session",
+        "DCS Attended Class",
+        1,
+    ),
+    "attended_zoom": (
+        "Attended (Zoom)",
+        "Attended Class Session-Zoom",
+        "DCS Attended Class-Zoom",
+        1,
+    ),
+    "absent": ("Absent", "Absent From Class", "Absent From Class", None),
+    "excused": ("Excused", "Absence Excused", "Absence Excused", None),
+}
+
+ATTENDANCE_OUTCOME_CHOICES = [("", "Not in this class")] + [
+    (outcome, label) for outcome, (label, _, _, _) in ATTENDANCE_OUTCOMES.items()
+]
+
+
+def record_class_session(session, roster, updated_by="System"):
+    """
+    Writes one class session's attendance for a whole roster in one transaction: a
+    Service row per client and a CaseNote per client who attended, each with a
+    single bulk_create(). Ledger summaries and other aggregates are refreshed once
+    for the batch through bulk_saved.
+
+    session has the date, start_time, end_time, facilitator, class_topic, location
+    and notes of the class; roster maps each Client to an ATTENDANCE_OUTCOMES key.
+    Returns the created (services, case notes).
+    """
+    services = []
+    notes = []
+    for client, outcome in roster.items():
+        _, desc, dcs_desc, credit = ATTENDANCE_OUTCOMES[outcome]
+        service = Service(
+            client=client,
+            date=session["date"],
+            desc=dcs_desc if client.dcs else desc,
+            credit=credit,
+            last_updated_by=updated_by,
+        )
+        service.fill_derived_fields()
+        services.append(service)
+        if credit:
+            notes.append(
+                CaseNote(
+                    client=client,
+                    date=session["date"],
+                    start_time=session["start_time"],
+                    end_time=session["end_time"],
+                    facilitator=session["facilitator"],
+                    class_topic=session["class_topic"],
+                    location=session["location"],
+                    notes=session.get("notes", ""),
+                    last_updated_by=updated_by,
+                )
+            )
+
+    with transaction.atomic():
+        services = Service.objects.bulk_create(services)
+        notes = CaseNote.objects.bulk_create(notes)
+        bulk_saved.send(sender=Service, instances=services)
+        bulk_saved.send(sender=CaseNote, instances=notes)
+    return services, notes
@@ -0,0 +1,172 @@
+from collections import defaultdict, namedtuple
+from functools import reduce
+from operator import or_
+
+from django.db.models import Q
+
+from records.models import Client, normalize_email, normalize_phone, soundex
+from records.search import edit_distance
+
+# Client columns duplicate detection compares, loaded without model instances
+RECORD_FIELDS = [
+    "id",
+    "f_name",
+    "l_name",
+    "f_name_soundex",
+    "l_name_soundex",
+    "dob",
+    "phone_digits",
+    "email_lower",
+]
+
+DuplicateRecord = namedtuple("DuplicateRecord", RECORD_FIELDS)
+
+# Scores at or above this are reported as likely duplicates
+DUPLICATE_THRESHOLD = 0.6
+
+# Blocks larger than this (e.g. a shared office phone) are too common to compare
+MAX_BLOCK = 100
+
+# Shortest phone number treated as identifying
+MIN_PHONE_DIGITS = 7
+
+
+def client_record(client):
+    """A DuplicateRecord for a client instance, which may not be saved yet"""
+    return DuplicateRecord(
+        client.pk,
+        client.f_name,
+        client.l_name,
+        soundex(client.f_name),
+        soundex(client.l_name),
+        client.dob,
+        normalize_phone(client.phone or ""),
+        normalize_email(client.email or ""),
+    )
+
+
+def blocking_keys(record):
+    """
+    Keys a likely duplicate must share at least one of: both names' Soundex codes,
+    the last name's Soundex code with the birth year, the phone number or the email
+    """
+    keys = []
+    if record.l_name_soundex:
+        keys.append(("names", record.l_name_soundex, record.f_name_soundex))
+        if record.dob:
+            keys.append(("name_year", record.l_name_soundex, record.dob.year))
+    if len(record.phone_digits) >= MIN_PHONE_DIGITS:
+        keys.append(("phone", record.phone_digits))
+    if record.email_lower:
+        keys.append(("email", record.email_lower))
+    return keys
+
+
+def key_q(key):
+    """The indexed lookup finding the clients in a block"""
+    kind, *values = key
+    if kind == "names":
+        return Q(l_name_soundex=values[0], f_name_soundex=values[1])
+    if kind == "name_year":
+        return Q(l_name_soundex=values[0], dob__year=values[1])
+    if kind == "phone":
+        return Q(phone_digits=values[0])
+    return Q(email_lower=values[0])
+
+
+def similarity(a, b):
+    """Likelihood from 0 to 1 that two records are the same person"""
+    distance = edit_distance(a.f_name.lower(), b.f_name.lower(), 3) + edit_distance(
+        a.l_name.lower(), b.l_name.lower(), 3
+    )
+    score = 0.6 * max(0.0, 1 - distance / 6)
+    if a.dob and b.dob:
+        score += 0.2 if a.dob == b.dob else -0.3
+    if len(a.phone_digits) >= MIN_PHONE_DIGITS and a.phone_digits == b.phone_digits:
+        score += 0.25
+    if a.email_lower and a.email_lower == b.email_lower:
+        score += 0.25
+    return max(0.0, min(score, 1.0))
+
+
+def find_duplicates(client, threshold=DUPLICATE_THRESHOLD, limit=5):
+    """
+    Existing clients that look like the given one, as (score, record) pairs with
+    the best match first. Only the client's blocks are read, through indexed
+    lookups, so the cost does not grow with the table.
+    """
+    record = client_record(client)
+    keys = blocking_keys(record)
+    if not keys:
+        return []
+    candidates = (
+        Client.objects.filter(reduce(or_, (key_q(key) for key in keys)))
+        .exclude(pk=client.pk)
+        .values_list(*RECORD_FIELDS)[: MAX_BLOCK * len(keys)]
+    )
+    matches = []
+    for row in candidates:
+        candidate = DuplicateRecord(*row)
+        score = similarity(record, candidate)
+        if score >= threshold:
+            matches.append((score, candidate))
+    matches.sort(key=lambda match: (-match[0], match[1].id))
+    return matches[:limit]
+
+
+def duplicate_clusters(threshold=DUPLICATE_THRESHOLD, max_block=MAX_BLOCK):
+    """
+    Groups every live client into clusters of likely duplicates. Clients are read
+    once and bucketed by blocking key, and only pairs sharing a block are scored, so
+    the pass stays near-linear in the number of clients.
+
+    Returns ([(best pair score, [records])], number of blocks skipped as too large),
+    with the most confident clusters first.
+    """
+    records = {}
+    blocks = defaultdict(list)
+    for row in Client.objects.values_list(*RECORD_FIELDS).iterator(chunk_size=5000):
+        record = DuplicateRecord(*row)
+        records[record.id] = record
+        for key in blocking_keys(record):
+            blocks[key].append(record.id)
+
+    # Union-find over the pairs that score as duplicates
+    parent = {}
+
+    def root(id):
+        while parent.get(id, id) != id:
+            id = parent[id]
+        return id
+
+    scored = set()
+    best = {}
+    skipped = 0
+    for ids in blocks.values():
+        if len(ids) > max_block:
+            skipped += 1
+            continue
+        for index, a in enumerate(ids):
+            for b in ids[index + 1 :]:
+                if (a, b) in scored:
+                    continue
+                scored.add((a, b))
+                score = similarity(records[a], records[b])
+                if score < threshold:
+                    continue
+                root_a, root_b = root(a), root(b)
+                if root_a != root_b:
+                    parent[root_b] = root_a
+                    best[root_a] = max(best.get(root_a, 0), best.pop(root_b, 0))
+                parent.setdefault(a, a)
+                best[root_a] = max(best[root_a], score)
+
+    clusters = defaultdict(list)
+    for id in parent:
+        clusters[root(id)].append(records[id])
+    results = [
+        (best[cluster_root], sorted(members))
+        for cluster_root, members in clusters.items()
+    ]
+    results.sort(key=lambda cluster: (-cluster[0], cluster[1][0].id))
+    return results, skipped
@@ -0,0 +1,117 @@
+import csv
+from itertools import chain
+
+from django.http import StreamingHttpResponse
+
+from records.models import CURRENT_STATUS_CHOICES, SERVICE_CATEGORY_CHOICES
+
+# Rows fetched per database round trip while streaming
+EXPORT_CHUNK_SIZE = 2000
+
+STATUS_LABELS = dict(CURRENT_STATUS_CHOICES)
+CATEGORY_LABELS = dict(SERVICE_CATEGORY_CHOICES)
+
+# (CSV header, queryset field, optional formatter) for each exported column
+CLIENT_COLUMNS = [
+    ("ID", "id", None),
+    ("First Name", "f_name", None),
+    ("Middle Name", "m_name", None),
+    ("Last Name", "l_name", None),
+    ("Location", "primary_location", None),
+    ("Status", "current_status", STATUS_LABELS.get),
+    ("Email", "email", None),
+    ("Phone", "phone", None),
+    ("DCS", "dcs", None),
+    ("Date of Birth", "dob", None),
+    ("Enrolled", "date_enroll", None),
+    ("Discharged", "date_discharge", None),
+    ("Credits", "ledger_credits", None),
+    ("Fees", "ledger_fees", None),
+    ("Discounts", "ledger_discounts", None),
+    ("Payments", "ledger_payments", None),
+    ("Balance", "ledger_balance", None),
+    ("Sessions Left", "ledger_sessions_left", None),
+]
+
+REFERRAL_COLUMNS = [
+    ("ID", "id", None),
+    ("Agency", "agency", None),
+    ("Name", "full_name", None),
+    ("Email", "email", None),
+    ("Phone", "phone", None),
+]
+
+SERVICE_COLUMNS = [
+    ("ID", "id", None),
+    ("Date", "date", None),
+    ("Client ID", "client_id", None),
+    ("Client First Name", "client__f_name", None),
+    ("Client Last Name", "client__l_name", None),
+    ("Service", "desc", None),
+    ("Category", "category", CATEGORY_LABELS.get),
+    ("Fee", "fee", None),
+    ("Discount", "discount", None),
+    ("Payment", "payment", None),
+    ("Credit", "credit", None),
+]
+
+
+# Spreadsheets run a cell starting with one of these as a formula
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def escape_cell(value):
+    """Prefixes text a spreadsheet would run as a formula with ', so it shows as text"""
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+class Echo:
+    """A file-like object whose write() hands the line straight back, for csv.writer"""
+
+    def write(self, value):
+        return value
+
+
+def export_rows(queryset, columns):
+    """
+    Streams the columns of a queryset as lists, chunk by chunk, so memory stays flat
+    however many rows there are. Text that would run as a formula is escaped.
+    """
+    fields = [field for _, field, _ in columns]
+    formatters = [
+        (index, format) for index, (_, _, format) in enumerate(columns) if format
+    ]
+    for row in queryset.values_list(*fields).iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        row = list(row)
+        for index, format in formatters:
+            row[index] = format(row[index], row[index])
+        yield [escape_cell(value) for value in row]
+
+
+def stream_csv(filename, queryset, columns):
+    writer = csv.writer(Echo())
+    header = [header for header, _, _ in columns]
+    response = StreamingHttpResponse(
+        (
+            writer.writerow(row)
+            for row in chain([header], export_rows(queryset, columns))
+        ),
+        content_type="text/csv",
+    )
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
+def export_clients(filename, clients):
+    # Ledger totals are aggregated in the export query itself, not per row
+    return stream_csv(filename, clients.with_ledger_totals(), CLIENT_COLUMNS)
+
+
+def export_referrals(filename, referrals):
+    return stream_csv(filename, referrals, REFERRAL_COLUMNS)
+
+
+def export_services(filename, services):
+    return stream_csv(filename, services, SERVICE_COLUMNS)
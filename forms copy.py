@@ -1,6 +1,10 @@
 from django import forms
 from django.forms import ModelForm, TimeInput, DateInput
-from datetime import date, time, datetime
+import csv
+import io
+from datetime import MAXYEAR, date, time, datetime
+from functools import reduce
+from operator import or_
 
 import records.models
 from records.models import (
@@ -9,6 +13,7 @@ from records.models import (
     CaseNote,
     Referral,
     SERVICE_CHOICES,
+    SERVICE_CATEGORY_CHOICES,
     LOCATION_CHOICES,
     MAX_EMAIL,
     MAX_NAME,
@@ -16,8 +21,14 @@ from records.models import (
     CURRENT_STATUS_CHOICES,
     FEE_CHOICES,
     DISCOUNT_CHOICES,
+    referral_choice_string,
+    referral_choices,
 )
 from django.contrib.auth.models import User
+from django.db.models import Q, QuerySet
+from django.urls import reverse_lazy
+from records.attendance import ATTENDANCE_OUTCOME_CHOICES
+from records.duplicates import find_duplicates
 
 
 class ServiceForm(ModelForm):
@@ -55,7 +66,42 @@ class ServiceForm(ModelForm):
             self.fields[field].widget.attrs.update({"class": "form-control"})
 
 
-class ClientForm(ModelForm):
+class DuplicateWarningMixin:
+    """
+    Holds back the first submission of a new client that looks like an existing one
+    and lists the likely matches. Ticking confirm_new saves it anyway.
+    """
+
+    def clean(self):
+        cleaned_data = super().clean()
+        self.duplicates = []
+        if self.instance.pk is not None or cleaned_data.get("confirm_new"):
+            return cleaned_data
+        if self.errors:
+            return cleaned_data
+        client = Client(
+            **{
+                field: cleaned_data.get(field)
+                for field in ("f_name", "l_name", "dob", "phone", "email")
+                if field in cleaned_data
+            }
+        )
+        self.duplicates = find_duplicates(client)
+        if self.duplicates:
+            matches = ", ".join(
+                f"{record.f_name} {record.l_name} (#{record.id})".title()
+                for _, record in self.duplicates
+            )
+            raise forms.ValidationError(
+                f"Possible duplicate of: {matches}. "
+                "Tick “Not a duplicate” to add this client anyway."
+            )
+        return cleaned_data
+
+
+class ClientForm(DuplicateWarningMixin, ModelForm):
+    confirm_new = forms.BooleanField(label="Not a duplicate", required=False)
+
     class Meta:
         model = Client
         fields = "__all__"
@@ -145,7 +191,9 @@ class ReferralForm(ModelForm):
             self.fields[field].widget.attrs.update({"class": "form-control"})
 
 
-class ReferralClientForm(ModelForm):
+class ReferralClientForm(DuplicateWarningMixin, ModelForm):
+    confirm_new = forms.BooleanField(label="Not a duplicate", required=False)
+
     class Meta:
         model = Client
         fields = ["f_name", "l_name", "email"]
@@ -158,16 +206,42 @@ class ReferralClientForm(ModelForm):
             self.fields[field].widget.attrs.update({"class": "form-control"})
 
 
+def date_range_fields(label):
+    """Returns the optional <field>_from / <field>_to inputs searched as a date range"""
+    return (
+        forms.DateField(
+            label=f"{label} From",
+            required=False,
+            widget=DateInput(attrs={"type": "date"}),
+        ),
+        forms.DateField(
+            label=f"{label} To",
+            required=False,
+            widget=DateInput(attrs={"type": "date"}),
+        ),
+    )
+
+
 class SearchForm(forms.Form):
     search_type = forms.ChoiceField(
         label="Search Type",
-        choices=(("Clients", "Clients"), ("Referrals", "Referrals")),
+        choices=(
+            ("Clients", "Clients"),
+            ("Referrals", "Referrals"),
+            ("Services", "Services"),
+        ),
         required=True,
     )
     f_name = forms.CharField(label="First Name", max_length=MAX_NAME, required=False)
     l_name = forms.CharField(label="Last Name", max_length=MAX_NAME, required=False)
+    name_match = forms.ChoiceField(
+        label="Match Names",
+        choices=(("", "As Typed"), ("phonetic", "Sounds Like")),
+        required=False,
+    )
     phone = forms.CharField(label="Phone", max_length=MAX_PHONE, required=False)
     email = forms.CharField(label="Email", max_length=MAX_EMAIL, required=False)
+    cause = forms.CharField(label="Cause Number", max_length=25, required=False)
     locations = forms.MultipleChoiceField(
         label="Locations",
         required=False,
@@ -177,12 +251,22 @@ class SearchForm(forms.Form):
     status = forms.MultipleChoiceField(
         label="Status", choices=CURRENT_STATUS_CHOICES, required=False
     )
+    dob_from, dob_to = date_range_fields("Date of Birth")
+    date_enroll_from, date_enroll_to = date_range_fields("Enrolled")
+    date_discharge_from, date_discharge_to = date_range_fields("Discharged")
     full_name = forms.CharField(
         label="Full Name", max_length=MAX_NAME * 2, required=False
     )
     agency = forms.CharField(label="Agency", max_length=50, required=False)
     ref_phone = forms.CharField(label="Phone", max_length=MAX_PHONE, required=False)
     ref_email = forms.CharField(label="Email", max_length=MAX_EMAIL, required=False)
+    service_desc = forms.MultipleChoiceField(
+        label="Service", choices=SERVICE_CHOICES, required=False
+    )
+    service_category = forms.TypedMultipleChoiceField(
+        label="Category", choices=SERVICE_CATEGORY_CHOICES, coerce=int, required=False
+    )
+    service_date_from, service_date_to = date_range_fields("Service Date")
 
     def __init__(self, *args, **kwargs):
         super(SearchForm, self).__init__(*args, **kwargs)
@@ -191,25 +275,61 @@ class SearchForm(forms.Form):
         for field in self.fields:
             self.fields[field].widget.attrs.update({"class": "form-control"})
 
+    def clean(self):
+        cleaned_data = super().clean()
+        for field in ("dob", "date_enroll", "date_discharge", "service_date"):
+            start = cleaned_data.get(f"{field}_from")
+            end = cleaned_data.get(f"{field}_to")
+            if start and end and start > end:
+                self.add_error(f"{field}_to", "End date is before start date.")
+        return cleaned_data
+
+
+class ReferralChoiceField(forms.ChoiceField):
+    """
+    Checks a submitted "agency--full_name" with one indexed lookup instead of
+    against the whole choice list
+    """
+
+    def valid_value(self, value):
+        value = str(value)
+        # Agencies and names may contain "--" too, so every split of the value is
+        # tried, each one an exact match of both columns
+        splits = [
+            Q(agency=value[:index], full_name=value[index + 2 :])
+            for index in range(len(value) - 1)
+            if value.startswith("--", index)
+        ]
+        return bool(splits) and Referral.objects.filter(reduce(or_, splits)).exists()
+
 
 class ReferralSelectForm(forms.Form):
-    # ref_choices.insert(0, ('', ''))
-    full_name = forms.ChoiceField(label="Referral Name", required=False)
+    full_name = ReferralChoiceField(label="Referral Name", required=False)
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, remote=False, **kwargs):
         super(ReferralSelectForm, self).__init__(*args, **kwargs)
-        self.fields["full_name"].widget.attrs.update({"class": "form-control"})
-        ref_choices = [
-            tuple(
-                [self.get_referral_string(referral), self.get_referral_string(referral)]
+        field = self.fields["full_name"]
+        field.widget.attrs.update({"class": "form-control"})
+        if remote:
+            # Only the current value is rendered; remote-select.js fetches the rest
+            selected = self.data.get(self.add_prefix("full_name")) or self.initial.get(
+                "full_name"
             )
-            for referral in Referral.objects.all()
-        ]
-        ref_choices.insert(0, ("", ""))
-        self.fields["full_name"].choices = ref_choices
+            field.choices = [("", "")] + ([(selected, selected)] if selected else [])
+            field.widget.attrs.update(
+                {
+                    "class": "form-control remote-select",
+                    "data-url": reverse_lazy("records:referral-choices"),
+                }
+            )
+        else:
+            # Loaded from the cache only when the select is rendered, not on POST
+            field.choices = lambda: [("", "")] + [
+                (choice, choice) for choice in referral_choices()
+            ]
 
     def get_referral_string(self, referral):
-        return f"{referral.agency}--{referral.full_name}"
+        return referral_choice_string(referral.agency, referral.full_name)
 
 
 class YearMonthForm(forms.Form):
@@ -228,6 +348,180 @@ class YearMonthForm(forms.Form):
         self.fields["year"].widget.attrs.update({"class": "form-control"})
 
 
+class MonthlyReportForm(YearMonthForm):
+    # Reports read from rollup tables, so any year with services can be shown. The
+    # period ends on January 1st of the next year, which must still be a date.
+    year = forms.IntegerField(min_value=2000, max_value=MAXYEAR - 1, required=False)
+    location = forms.ChoiceField(
+        label="Location",
+        required=False,
+        choices=[("", "All Locations")] + LOCATION_CHOICES,
+    )
+
+    def __init__(self, *args, **kwargs):
+        super(MonthlyReportForm, self).__init__(*args, **kwargs)
+        self.fields["location"].widget.attrs.update({"class": "form-control"})
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if not (
+            cleaned_data.get("all_time")
+            or cleaned_data.get("month")
+            or cleaned_data.get("year")
+        ):
+            raise forms.ValidationError(self.help_text)
+        return cleaned_data
+
+
+class AttendanceReportForm(forms.Form):
+    start = forms.DateField(
+        label="From", required=False, widget=DateInput(attrs={"type": "date"})
+    )
+    end = forms.DateField(
+        label="To", required=False, widget=DateInput(attrs={"type": "date"})
+    )
+    location = forms.ChoiceField(
+        label="Location",
+        required=False,
+        choices=[("", "All Locations")] + LOCATION_CHOICES,
+    )
+
+    def __init__(self, *args, **kwargs):
+        super(AttendanceReportForm, self).__init__(*args, **kwargs)
+        self.template_name_div = "forms/div.html"
+        self.template_name_label = "forms/label.html"
+        for field in self.fields:
+            self.fields[field].widget.attrs.update({"class": "form-control"})
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start = cleaned_data.get("start")
+        end = cleaned_data.get("end")
+        if start and end and start > end:
+            raise forms.ValidationError("Start date is after end date.")
+        return cleaned_data
+
+
+class ClassSessionForm(forms.Form):
+    # One class session and each rostered client's outcome, submitted together
+    SESSION_FIELDS = [
+        "location",
+        "date",
+        "start_time",
+        "end_time",
+        "facilitator",
+        "class_topic",
+        "notes",
+    ]
+    location = forms.ChoiceField(label="Location", choices=LOCATION_CHOICES)
+    date = forms.DateField(
+        label="Date",
+        widget=DateInput(attrs={"type": "date", "value": date.today()}),
+    )
+    start_time = forms.TimeField(
+        label="Start Time", widget=TimeInput(attrs={"type": "time", "step": 60})
+    )
+    end_time = forms.TimeField(
+        label="End Time", widget=TimeInput(attrs={"type": "time", "step": 60})
+    )
+    facilitator = forms.CharField(label="Facilitator", max_length=25)
+    class_topic = forms.CharField(label="Class Topic", max_length=25)
+    notes = forms.CharField(
+        label="Notes",
+        max_length=200,
+        required=False,
+        widget=forms.Textarea(attrs={"rows": "2", "cols": "40"}),
+    )
+
+    def __init__(self, *args, **kwargs):
+        # An outcome field is added for each client on the roster
+        self.clients = list(kwargs.pop("clients", []))
+        super(ClassSessionForm, self).__init__(*args, **kwargs)
+        self.template_name_div = "forms/div.html"
+        self.template_name_label = "forms/label.html"
+        for field in self.fields:
+            self.fields[field].widget.attrs.update({"class": "form-control"})
+        for client in self.clients:
+            self.fields[self.outcome_field(client)] = forms.ChoiceField(
+                label=str(client),
+                choices=ATTENDANCE_OUTCOME_CHOICES,
+                required=False,
+                widget=forms.Select(attrs={"class": "form-select"}),
+            )
+
+    @staticmethod
+    def outcome_field(client):
+        return f"outcome_{client.pk}"
+
+    def session_fields(self):
+        return [self[field] for field in self.SESSION_FIELDS]
+
+    def roster_fields(self):
+        return [(client, self[self.outcome_field(client)]) for client in self.clients]
+
+    def session(self):
+        return {field: self.cleaned_data[field] for field in self.SESSION_FIELDS}
+
+    def roster(self):
+        """The outcome of each client marked on the roster, keyed by client"""
+        roster = {}
+        for client in self.clients:
+            outcome = self.cleaned_data.get(self.outcome_field(client))
+            if outcome:
+                roster[client] = outcome
+        return roster
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start_time = cleaned_data.get("start_time")
+        end_time = cleaned_data.get("end_time")
+        if start_time and end_time and start_time > end_time:
+            raise forms.ValidationError("Start time is after end time.")
+        if not self.roster():
+            raise forms.ValidationError("Mark at least one client's attendance.")
+        return cleaned_data
+
+
+class ImportForm(forms.Form):
+    kind = forms.ChoiceField(
+        label="Import",
+        choices=(
+            ("clients", "Clients"),
+            ("referrals", "Referrals"),
+            ("services", "Services"),
+        ),
+    )
+    file = forms.FileField(
+        label="CSV File", help_text="The header row names the fields of each column"
+    )
+    dry_run = forms.BooleanField(label="Validate only", required=False)
+
+    def __init__(self, *args, **kwargs):
+        super(ImportForm, self).__init__(*args, **kwargs)
+        self.template_name_div = "forms/div.html"
+        self.template_name_label = "forms/label.html"
+        for field in ("kind", "file"):
+            self.fields[field].widget.attrs.update({"class": "form-control"})
+
+    def clean_file(self):
+        # The whole file is decoded and parsed before anything is imported, so one
+        # that cannot be read is rejected instead of stopping part way through.
+        # cleaned_data["file"] is the decoded text.
+        try:
+            text = self.cleaned_data["file"].read().decode("utf-8-sig")
+        except UnicodeDecodeError:
+            raise forms.ValidationError("The file must be a UTF-8 encoded CSV.")
+        reader = csv.reader(io.StringIO(text, newline=""))
+        try:
+            for _ in reader:
+                pass
+        except csv.Error as error:
+            raise forms.ValidationError(
+                f"Line {reader.line_num} is not valid CSV: {error}"
+            )
+        return text
+
+
 class UserProfileForm(ModelForm):
     class Meta:
         model = User
@@ -241,25 +535,67 @@ class UserProfileForm(ModelForm):
             self.fields[field].widget.attrs.update({"class": "form-control"})
 
 
+class ClientMultipleChoiceField(forms.MultipleChoiceField):
+    """
+    Checks every submitted client id with one pk__in query in queryset instead of
+    against the whole choice list. Cleans to the list of submitted ids.
+    """
+
+    # Largest id a 64-bit primary key column holds
+    max_id = 2**63 - 1
+
+    def __init__(self, *args, queryset=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.queryset = Client.objects.all() if queryset is None else queryset
+
+    def validate(self, value):
+        if self.required and not value:
+            raise forms.ValidationError(
+                self.error_messages["required"], code="required"
+            )
+        ids = {}
+        for submitted in value:
+            try:
+                pk = int(submitted)
+            except (TypeError, ValueError):
+                pk = None
+            if pk is None or not 0 < pk <= self.max_id:
+                self.invalid_choice(submitted)
+            ids[pk] = submitted
+        found = set(self.queryset.filter(pk__in=ids).values_list("pk", flat=True))
+        if len(found) != len(ids):
+            self.invalid_choice(next(ids[pk] for pk in ids if pk not in found))
+
+    def invalid_choice(self, value):
+        raise forms.ValidationError(
+            self.error_messages["invalid_choice"],
+            code="invalid_choice",
+            params={"value": value},
+        )
+
+
 class RefMultiClientForm(forms.Form):
     def __init__(self, *args, **kwargs):
-        client_choices = kwargs.get("client_choices")
-        if client_choices:
-            del kwargs["client_choices"]
+        client_choices = kwargs.pop("client_choices", None)
         super(RefMultiClientForm, self).__init__(*args, **kwargs)
         self.template_name_div = "forms/div.html"
-        self.fields["clients"] = forms.ChoiceField(label="Clients Found")
-        if client_choices:
-            self.fields["clients"].choices = [
-                tuple([client.id, self.get_client_string(client)])
-                for client in client_choices
-            ]
+        # Only the clients shown get display strings. When none are given (e.g. on
+        # POST), any live client is valid, and the submitted ids are checked with a
+        # single pk__in query. cleaned_data["clients"] is the list of submitted ids,
+        # so views can add or remove every selected client in one call.
+        if client_choices is None:
+            self.fields["clients"] = ClientMultipleChoiceField(label="Clients Found")
         else:
-            # this is so that a form error is not thrown because there are no available choices when calling RefMultiClientForm(request.POST)
-            # this makes it so that all the clients in the database are valid choices
-            self.fields["clients"].choices = [
-                tuple([client.id, self.get_client_string(client)])
-                for client in Client.objects.all()
+            if not isinstance(client_choices, QuerySet):
+                client_choices = Client.objects.filter(
+                    pk__in=[client.pk for client in client_choices]
+                )
+            self.fields["clients"] = ClientMultipleChoiceField(
+                label="Clients Found", queryset=client_choices
+            )
+            # Formatted only when the select is rendered
+            self.fields["clients"].choices = lambda: [
+                (client.id, self.get_client_string(client)) for client in client_choices
             ]
         self.fields["clients"].widget.attrs.update({"class": "form-control"})
 
@@ -0,0 +1,201 @@
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from records.models import Client, Referral, bulk_saved
+
+# Columns indexed for full-text search on each model
+FULLTEXT_FIELDS = {
+    Client: [
+        "f_name",
+        "m_name",
+        "l_name",
+        "email",
+        "phone",
+        "phone_digits",
+        "cause",
+        "cause2",
+        "cause3",
+    ],
+    Referral: ["full_name", "agency", "email"],
+}
+
+# The trigram tokenizer, which matches text anywhere in a column, needs SQLite 3.34
+TRIGRAM_SQLITE_VERSION = (3, 34, 0)
+
+# Shortest text a trigram index can match; shorter text falls back to icontains
+TRIGRAM_LENGTH = 3
+
+
+def fulltext_table(model):
+    return f"{model._meta.db_table}_fts"
+
+
+def quote(text):
+    """An FTS5 string literal, which a trigram index matches as a substring"""
+    return '"' + text.replace('"', '""') + '"'
+
+
+def match_expression(terms):
+    """
+    Builds an FTS5 query from (columns, text) pairs, where each text must appear
+    somewhere in one of its columns, like icontains, e.g.
+    [(("f_name", "l_name"), "ohns"), (("email",), "x@y")]
+    -> {f_name l_name} : "ohns" AND {email} : "x@y"
+    """
+    return " AND ".join(
+        f"{{{' '.join(columns)}}} : {quote(text)}" for columns, text in terms
+    )
+
+
+class FullTextBackend:
+    """
+    Interface for full-text backends. The default is unavailable, which makes
+    search fall back to icontains lookups.
+    """
+
+    def available(self):
+        return False
+
+    def can_match(self, text):
+        """Whether text is long enough for the index to match"""
+        return False
+
+    def index(self, instance):
+        pass
+
+    def index_many(self, model, instances):
+        for instance in instances:
+            self.index(instance)
+
+    def remove(self, model, pk):
+        pass
+
+    def matches(self, model, terms):
+        """
+        (Q on the rows matching every (columns, text) pair, expression ranking them
+        with the best first). Both run inside the caller's query, so its scope and
+        filters apply to every hit.
+        """
+        raise NotImplementedError
+
+
+class SQLiteFTS5Backend(FullTextBackend):
+    """
+    Keeps one FTS5 trigram table per model, with rowid equal to the model's pk, so
+    text is matched anywhere in a column, as icontains does
+    """
+
+    def available(self):
+        return (
+            connection.vendor == "sqlite"
+            and connection.Database.sqlite_version_info >= TRIGRAM_SQLITE_VERSION
+        )
+
+    def can_match(self, text):
+        return len(text) >= TRIGRAM_LENGTH
+
+    @staticmethod
+    def create_table(cursor, model_table, columns):
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {model_table}_fts "
+            f"USING fts5({', '.join(columns)}, tokenize='trigram')"
+        )
+
+    @staticmethod
+    def fill_table(cursor, model_table, columns, rows):
+        """Inserts (pk, *columns) rows, replacing any already indexed"""
+        rows = list(rows)
+        cursor.executemany(
+            f"DELETE FROM {model_table}_fts WHERE rowid = %s",
+            [[row[0]] for row in rows],
+        )
+        cursor.executemany(
+            f"INSERT INTO {model_table}_fts (rowid, {', '.join(columns)}) "
+            f"VALUES ({', '.join(['%s'] * (len(columns) + 1))})",
+            rows,
+        )
+
+    def index(self, instance):
+        self.index_many(type(instance), [instance])
+
+    def index_many(self, model, instances):
+        columns = FULLTEXT_FIELDS[model]
+        rows = [
+            [instance.pk] + [getattr(instance, column) or "" for column in columns]
+            for instance in instances
+        ]
+        with connection.cursor() as cursor:
+            self.fill_table(cursor, model._meta.db_table, columns, rows)
+
+    def remove(self, model, pk):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {fulltext_table(model)} WHERE rowid = %s", [pk]
+            )
+
+    def matches(self, model, terms):
+        # Joined through the model's fulltext relation (ClientFullText and
+        # ReferralFullText), so FTS5 finds and ranks the hits once per query
+        return Q(fulltext__match=match_expression(terms)), F("fulltext__rank")
+
+
+def get_backend():
+    """The backend named by settings.RECORDS_FULLTEXT_BACKEND, or FTS5 on SQLite"""
+    path = getattr(settings, "RECORDS_FULLTEXT_BACKEND", None)
+    if path:
+        return import_string(path)()
+    if connection.vendor == "sqlite":
+        return SQLiteFTS5Backend()
+    return FullTextBackend()
+
+
+def search_fulltext(model, terms):
+    """
+    Matches the (columns, text) pairs the full-text backend can. Returns a Q on the
+    hits, an expression ranking them and the pairs left over (e.g. text too short
+    for the index), or (None, None, terms) when no backend is available or it can
+    match none of them. The caller matches the leftovers some other way.
+    """
+    backend = get_backend()
+    if not backend.available():
+        return None, None, terms
+    matched = [term for term in terms if backend.can_match(term[1])]
+    if not matched:
+        return None, None, terms
+    query, rank = backend.matches(model, matched)
+    return query, rank, [term for term in terms if not backend.can_match(term[1])]
+
+
+@receiver(post_save, sender=Client)
+@receiver(post_save, sender=Referral)
+def fulltext_saved(sender, instance, **kwargs):
+    backend = get_backend()
+    if not backend.available():
+        return
+    if instance.deleted:
+        backend.remove(sender, instance.pk)
+    else:
+        backend.index(instance)
+
+
+@receiver(bulk_saved, sender=Client)
+@receiver(bulk_saved, sender=Referral)
+def fulltext_bulk_saved(sender, instances, **kwargs):
+    backend = get_backend()
+    if backend.available():
+        # Soft-deleted rows are not indexed, and new rows have nothing to remove
+        backend.index_many(
+            sender, [instance for instance in instances if not instance.deleted]
+        )
+
+
+@receiver(post_delete, sender=Client)
+@receiver(post_delete, sender=Referral)
+def fulltext_deleted(sender, instance, **kwargs):
+    backend = get_backend()
+    if backend.available():
+        backend.remove(sender, instance.pk)
@@ -0,0 +1,259 @@
+import csv
+from collections import namedtuple
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from records.models import (
+    DISCOUNT_CHOICES,
+    FEE_CHOICES,
+    SERVICE_CHOICES,
+    Client,
+    Referral,
+    Service,
+    bulk_saved,
+)
+
+# Rows validated and inserted per transaction
+IMPORT_BATCH_SIZE = 500
+
+RowError = namedtuple("RowError", ["line", "column", "value", "message"])
+
+
+class ImportReport:
+    """What an import created, and every row it skipped and why"""
+
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.errors = []
+        # RowError for the last line read before the file could not be read further,
+        # which ended the import; the batches before it stay imported
+        self.stopped = None
+
+    @property
+    def skipped(self):
+        return len({error.line for error in self.errors if error.line > 1})
+
+    def write_csv(self, file):
+        writer = csv.writer(file)
+        writer.writerow(RowError._fields)
+        writer.writerows(self.errors)
+        if self.stopped:
+            writer.writerow(self.stopped)
+
+
+class CSVImporter:
+    """
+    Imports the rows of a CSV file whose header names model fields, in batches.
+    Values are checked against sets of allowed choices, foreign keys are resolved
+    with one query per batch, and each batch's valid rows are inserted with one
+    bulk_create() in a transaction. Invalid rows are skipped and reported.
+    """
+
+    model = None
+    # Columns a file may set; everything else (e.g. soft-delete and secure-link
+    # fields) keeps its default
+    columns = []
+    # Columns the header must contain
+    required_columns = []
+    # Allowed values for columns the model itself does not restrict
+    extra_choices = {}
+
+    def __init__(self, batch_size=IMPORT_BATCH_SIZE, dry_run=False):
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.fields = {
+            field.attname: field
+            for field in self.model._meta.concrete_fields
+            if field.attname in self.columns
+        }
+        self.choices = {
+            name: self.choice_set(field, [key for key, _ in field.flatchoices])
+            for name, field in self.fields.items()
+            if field.choices
+        }
+        for name, values in self.extra_choices.items():
+            self.choices[name] = self.choice_set(self.fields[name], values)
+
+    @staticmethod
+    def choice_set(field, values):
+        # Compared after to_python(), so e.g. a fee of "25" matches "25.00"
+        return {field.to_python(value) for value in values}
+
+    def run(self, file):
+        report = ImportReport()
+        reader = csv.DictReader(file)
+        header = reader.fieldnames or []
+        missing = [column for column in self.required_columns if column not in header]
+        unknown = [column for column in header if column not in self.fields]
+        if missing:
+            report.errors.append(
+                RowError(1, ", ".join(missing), "", "Missing required columns")
+            )
+        if unknown:
+            report.errors.append(RowError(1, ", ".join(unknown), "", "Unknown columns"))
+        if missing or unknown:
+            return report
+
+        rows = enumerate(reader, start=2)
+        while True:
+            try:
+                batch = list(islice(rows, self.batch_size))
+            except (csv.Error, UnicodeDecodeError) as error:
+                report.stopped = RowError(
+                    reader.line_num, "", "", f"Cannot read the file: {error}"
+                )
+                return report
+            if not batch:
+                return report
+            report.rows += len(batch)
+            self.import_batch(batch, report)
+
+    def import_batch(self, batch, report):
+        valid = []
+        for line, row in batch:
+            values = self.clean_row(line, row, report)
+            if values is not None:
+                valid.append((line, values))
+        valid = self.resolve(valid, report)
+
+        instances = []
+        for _, values in valid:
+            instance = self.model(**values)
+            instance.fill_derived_fields()
+            instances.append(instance)
+        if not instances:
+            return
+        if self.dry_run:
+            # Counted as they would have been created
+            report.created += len(instances)
+            return
+        with transaction.atomic():
+            created = self.model.objects.bulk_create(instances)
+            bulk_saved.send(sender=self.model, instances=created)
+        report.created += len(created)
+
+    def clean_row(self, line, row, report):
+        """The row's values converted to Python, or None after reporting its errors"""
+        values = {}
+        errors = []
+        if None in row:
+            errors.append(RowError(line, "", "", "More values than header columns"))
+        for column, raw in row.items():
+            if column is None:
+                continue
+            field = self.fields[column]
+            raw = (raw or "").strip()
+            if raw == "":
+                if column in self.required_columns or (
+                    not field.blank and not field.has_default()
+                ):
+                    errors.append(
+                        RowError(line, column, raw, "This field is required.")
+                    )
+                elif field.null:
+                    values[column] = None
+                elif not field.has_default():
+                    values[column] = ""
+                continue
+            try:
+                value = field.to_python(raw)
+                field.run_validators(value)
+            except ValidationError as error:
+                errors.append(RowError(line, column, raw, " ".join(error.messages)))
+                continue
+            if column in self.choices and value not in self.choices[column]:
+                errors.append(
+                    RowError(line, column, raw, "Not one of the allowed choices.")
+                )
+                continue
+            values[column] = value
+        if errors:
+            report.errors.extend(errors)
+            return None
+        return values
+
+    def resolve(self, valid, report):
+        """Checks a batch's foreign keys in bulk; returns the rows that pass"""
+        return valid
+
+
+class ClientImporter(CSVImporter):
+    model = Client
+    columns = [
+        "f_name",
+        "m_name",
+        "l_name",
+        "phone",
+        "email",
+        "dcs",
+        "primary_location",
+        "dob",
+        "ethnicity",
+        "gender",
+        "language",
+        "relationship_status",
+        "employment_status",
+        "cause",
+        "cause2",
+        "cause3",
+        "date_enroll",
+        "date_discharge",
+        "date_complete",
+        "sesh_qty_orig",
+        "session_qty_add",
+        "current_status",
+    ]
+    required_columns = ["f_name", "l_name"]
+
+
+class ReferralImporter(CSVImporter):
+    model = Referral
+    columns = ["full_name", "agency", "phone", "email"]
+    required_columns = ["agency", "full_name"]
+
+
+class ServiceImporter(CSVImporter):
+    model = Service
+    # The category is derived from desc
+    columns = [
+        "client_id",
+        "date",
+        "desc",
+        "fee",
+        "discount",
+        "payment",
+        "credit",
+        "notes",
+    ]
+    required_columns = ["client_id", "date", "desc"]
+    extra_choices = {
+        "desc": [service for service, _ in SERVICE_CHOICES],
+        "fee": [fee for fee, _ in FEE_CHOICES],
+        "discount": [discount for discount, _ in DISCOUNT_CHOICES],
+    }
+
+    def resolve(self, valid, report):
+        # One query for every client the batch refers to
+        client_ids = {values["client_id"] for _, values in valid}
+        existing = set(
+            Client.objects.filter(pk__in=client_ids).values_list("pk", flat=True)
+        )
+        resolved = []
+        for line, values in valid:
+            if values["client_id"] in existing:
+                resolved.append((line, values))
+            else:
+                report.errors.append(
+                    RowError(line, "client_id", values["client_id"], "No such client.")
+                )
+        return resolved
+
+
+IMPORTERS = {
+    "clients": ClientImporter,
+    "referrals": ReferralImporter,
+    "services": ServiceImporter,
+}
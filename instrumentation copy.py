@@ -0,0 +1,223 @@
+import logging
+import re
+import threading
+import time
+from collections import Counter, defaultdict, deque
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# Requests kept per view for the rolling percentiles
+ROLLING_WINDOW = 1000
+
+# Queries a view may run before a warning is logged, unless
+# settings.RECORDS_QUERY_BUDGET says otherwise
+DEFAULT_QUERY_BUDGET = 50
+
+# Duplicate query fingerprints named in a budget warning
+WARN_DUPLICATES = 3
+
+PERCENTILES = (50, 95, 99)
+
+# (name, label, unit) of each measurement kept per request
+MEASURES = [
+    ("duration", "Total", "ms"),
+    ("queries", "Queries", ""),
+    ("db_time", "DB Time", "ms"),
+    ("render_time", "Render Time", "ms"),
+    ("size", "Response Size", "bytes"),
+]
+
+IN_LIST = re.compile(r"\((?:%s, )+%s\)")
+
+
+def fingerprint(sql):
+    """The SQL with IN lists of any length collapsed, so repeats of a query match"""
+    return IN_LIST.sub("(%s, ...)", sql)
+
+
+def percentile(ordered, percent):
+    """Nearest-rank percentile of a sorted list"""
+    index = max(0, -(-len(ordered) * percent // 100) - 1)
+    return ordered[index]
+
+
+def query_budget():
+    return getattr(settings, "RECORDS_QUERY_BUDGET", DEFAULT_QUERY_BUDGET)
+
+
+class QueryRecorder:
+    """A database execute wrapper counting and timing the queries of one request"""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def duplicates(self):
+        """(count, fingerprint) of queries run more than once, most repeated first"""
+        return [
+            (count, sql) for sql, count in self.fingerprints.most_common() if count > 1
+        ]
+
+
+class ViewMetrics:
+    """Rolling samples of every view's measurements, shared by the process's threads"""
+
+    def __init__(self, window=ROLLING_WINDOW):
+        self.window = window
+        self.lock = threading.Lock()
+        self.samples = defaultdict(lambda: deque(maxlen=self.window))
+        self.requests = Counter()
+        self.over_budget = Counter()
+        self.duplicates = defaultdict(Counter)
+
+    def record(self, view, sample, duplicates, over_budget):
+        with self.lock:
+            self.samples[view].append(sample)
+            self.requests[view] += 1
+            if over_budget:
+                self.over_budget[view] += 1
+            for count, sql in duplicates:
+                self.duplicates[view][sql] += count
+
+    def summary(self):
+        """
+        For each view, sorted by name: its request count, the number over the query
+        budget, {measure: {percentile: value}} over the rolling window, and its most
+        repeated query fingerprints
+        """
+        with self.lock:
+            samples = {view: list(rows) for view, rows in self.samples.items()}
+            requests = dict(self.requests)
+            over_budget = dict(self.over_budget)
+            duplicates = {
+                view: counts.most_common(WARN_DUPLICATES)
+                for view, counts in self.duplicates.items()
+            }
+        summary = []
+        for view in sorted(samples):
+            percentiles = {}
+            for name, _, _ in MEASURES:
+                values = sorted(
+                    sample[name] for sample in samples[view] if sample[name] is not None
+                )
+                percentiles[name] = {
+                    percent: percentile(values, percent) if values else None
+                    for percent in PERCENTILES
+                }
+            summary.append(
+                {
+                    "view": view,
+                    "requests": requests[view],
+                    "over_budget": over_budget.get(view, 0),
+                    "percentiles": percentiles,
+                    "duplicates": duplicates.get(view, []),
+                }
+            )
+        return summary
+
+    def clear(self):
+        with self.lock:
+            self.samples.clear()
+            self.requests.clear()
+            self.over_budget.clear()
+            self.duplicates.clear()
+
+
+metrics = ViewMetrics()
+
+
+def metrics_text(summary):
+    """A metrics summary in the Prometheus text format"""
+    lines = []
+    for row in summary:
+        view = row["view"]
+        lines.append(f'records_requests_total{{view="{view}"}} {row["requests"]}')
+        lines.append(
+            f'records_over_query_budget_total{{view="{view}"}} {row["over_budget"]}'
+        )
+        for name, _, unit in MEASURES:
+            metric = f"records_{name}_{unit}" if unit else f"records_{name}"
+            for percent, value in row["percentiles"][name].items():
+                if value is not None:
+                    lines.append(
+                        f'{metric}{{view="{view}",quantile="{percent / 100}"}}'
+                        f" {value:.3f}"
+                    )
+    return "\n".join(lines) + "\n"
+
+
+class RequestMetricsMiddleware:
+    """
+    Records each request's query count, database time, repeated queries, template
+    render time and response size under its view name, and logs a warning when a
+    view runs more queries than settings.RECORDS_QUERY_BUDGET.
+
+    Render time covers TemplateResponses, which are rendered after the view
+    returns; views that render inside the view body report it as part of the view.
+    Queries a streamed response runs while it is being sent are not counted.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        request._metrics_render = [None, None]
+        start = time.perf_counter()
+        with connections["default"].execute_wrapper(recorder):
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        match = getattr(request, "resolver_match", None)
+        view = match.view_name if match else "unresolved"
+        render_start, render_end = request._metrics_render
+        sample = {
+            "duration": duration * 1000,
+            "queries": recorder.queries,
+            "db_time": recorder.db_time * 1000,
+            "render_time": (
+                (render_end - render_start) * 1000 if render_end is not None else None
+            ),
+            # Streamed responses are not buffered, so their size is unknown
+            "size": None if response.streaming else len(response.content),
+        }
+        duplicates = recorder.duplicates()
+        over_budget = recorder.queries > query_budget()
+        metrics.record(view, sample, duplicates, over_budget)
+        if over_budget:
+            logger.warning(
+                "%s ran %d queries (budget %d) in %.0f ms; most repeated: %s",
+                view,
+                recorder.queries,
+                query_budget(),
+                sample["duration"],
+                "; ".join(
+                    f"{count}x {sql}" for count, sql in duplicates[:WARN_DUPLICATES]
+                )
+                or "none",
+            )
+        return response
+
+    def process_template_response(self, request, response):
+        # TemplateResponses render right after this hook returns
+        timing = request._metrics_render
+        timing[0] = time.perf_counter()
+
+        def rendered(response):
+            timing[1] = time.perf_counter()
+
+        response.add_post_render_callback(rendered)
+        return response
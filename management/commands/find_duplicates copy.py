@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from records.duplicates import DUPLICATE_THRESHOLD, MAX_BLOCK, duplicate_clusters
+
+
+class Command(BaseCommand):
+    help = "Reports clusters of clients that are likely duplicates of each other"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=DUPLICATE_THRESHOLD,
+            help="Lowest similarity (0-1) reported as a duplicate",
+        )
+        parser.add_argument(
+            "--max-block",
+            type=int,
+            default=MAX_BLOCK,
+            help="Skip blocking keys shared by more clients than this",
+        )
+
+    def handle(self, *args, **options):
+        threshold = options["threshold"]
+        if not 0 < threshold <= 1:
+            raise CommandError("--threshold must be between 0 and 1")
+        if options["max_block"] < 2:
+            raise CommandError("--max-block must be at least 2")
+
+        clusters, skipped = duplicate_clusters(threshold, options["max_block"])
+        for score, records in clusters:
+            self.stdout.write(f"Score {score:.2f}:")
+            for record in records:
+                self.stdout.write(
+                    f"  Client {record.id}: {record.f_name} {record.l_name}"
+                    f" dob={record.dob or '-'} phone={record.phone_digits or '-'}"
+                    f" email={record.email_lower or '-'}"
+                )
+        if skipped:
+            self.stdout.write(
+                self.style.WARNING(
+                    f"Skipped {skipped} blocking keys shared by more than"
+                    f" {options['max_block']} clients"
+                )
+            )
+        self.stdout.write(
+            self.style.SUCCESS(f"Found {len(clusters)} likely duplicate clusters")
+        )
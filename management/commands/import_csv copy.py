@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from records.imports import IMPORT_BATCH_SIZE, IMPORTERS
+
+
+class Command(BaseCommand):
+    help = "Imports clients, referrals or services from a CSV file whose header names model fields"
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=sorted(IMPORTERS))
+        parser.add_argument("path", help="CSV file to import")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=IMPORT_BATCH_SIZE,
+            help="Number of rows validated and inserted per transaction",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Validate every row and report errors without writing",
+        )
+        parser.add_argument(
+            "--errors",
+            help="Write the error report to this CSV file instead of the console",
+        )
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be at least 1")
+
+        importer = IMPORTERS[options["kind"]](
+            batch_size=options["batch_size"], dry_run=options["dry_run"]
+        )
+        try:
+            with open(options["path"], newline="", encoding="utf-8-sig") as file:
+                report = importer.run(file)
+        except OSError as error:
+            raise CommandError(f"Cannot read {options['path']}: {error}")
+
+        if options["errors"]:
+            with open(options["errors"], "w", newline="") as file:
+                report.write_csv(file)
+        else:
+            for error in report.errors:
+                self.stdout.write(
+                    f"Line {error.line} {error.column}: {error.message} ({error.value!r})"
+                )
+
+        verb = "Would import" if options["dry_run"] else "Imported"
+        summary = f"{verb} {report.created} of {report.rows} {options['kind']}"
+        if report.stopped:
+            # The batches before the unreadable line were already written
+            summary += (
+                f" before stopping after line {report.stopped.line}: "
+                f"{report.stopped.message}"
+            )
+        if report.errors:
+            summary += (
+                f"; skipped {report.skipped} rows with {len(report.errors)} errors"
+            )
+        if report.errors or report.stopped:
+            raise CommandError(summary)
+        self.stdout.write(self.style.SUCCESS(summary))
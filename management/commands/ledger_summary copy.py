@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from records.models import Client, ClientLedgerSummary
+
+
+class Command(BaseCommand):
+    help = "Rebuilds ClientLedgerSummary from the Service ledger, or verifies it with --verify"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verify",
+            action="store_true",
+            help="Report clients whose summary row is missing or out of date without writing",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of clients recomputed per query",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        if batch_size < 1:
+            raise CommandError("--batch-size must be at least 1")
+
+        client_ids = list(
+            Client.all_objects.order_by("pk").values_list("pk", flat=True)
+        )
+        batches = [
+            client_ids[index : index + batch_size]
+            for index in range(0, len(client_ids), batch_size)
+        ]
+
+        if not options["verify"]:
+            rebuilt = sum(
+                ClientLedgerSummary.objects.refresh(batch) for batch in batches
+            )
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt {rebuilt} ledger summaries"))
+            return
+
+        stale = []
+        for batch in batches:
+            stored = ClientLedgerSummary.objects.in_bulk(batch)
+            expected = (
+                Client.all_objects.filter(pk__in=batch)
+                .with_ledger_totals()
+                .with_last_service_date()
+            )
+            for client in expected:
+                summary = ClientLedgerSummary.from_client(client)
+                if client.pk not in stored or not stored[client.pk].matches(summary):
+                    stale.append(client.pk)
+
+        for client_id in stale:
+            self.stdout.write(f"Client {client_id}: summary missing or out of date")
+        if stale:
+            raise CommandError(
+                f"{len(stale)} of {len(client_ids)} ledger summaries are stale"
+            )
+        self.stdout.write(
+            self.style.SUCCESS(f"All {len(client_ids)} ledger summaries are up to date")
+        )
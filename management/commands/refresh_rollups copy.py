@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from records.models import MonthlyRollup, RollupDirtyMonth
+
+
+class Command(BaseCommand):
+    help = "Refreshes the monthly rollups of months whose services changed since the last run"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Rebuild the rollups of every month instead",
+        )
+
+    def handle(self, *args, **options):
+        if options["full"]:
+            with transaction.atomic():
+                RollupDirtyMonth.objects.all().delete()
+                rows = MonthlyRollup.objects.refresh()
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} rollup rows"))
+            return
+
+        months = sorted(MonthlyRollup.objects.refresh_dirty())
+        for month in months:
+            self.stdout.write(f"Refreshed {month:%Y-%m}")
+        self.stdout.write(self.style.SUCCESS(f"Refreshed {len(months)} months"))
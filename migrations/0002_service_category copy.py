@@ -0,0 +1,178 @@
+from django.db import migrations, models
+
+# Frozen copies of the service list and categorize_service() as of this
+# migration, so later changes to records.models cannot change the backfill
+SERVICES = [
+    "Attended Class Session",
+    "Attended Class Session-Zoom",
+    "DCS Attended Class",
+    "DCS Attended Class-Zoom",
+    "0 Absences Remaining",
+    "1 Absence Remaining",
+    "2 Absences Remaining ",
+    "Absence Excused By Program Director",
+    "Absence Excused",
+    "Absent From Class",
+    "Active Status Reinstated",
+    "Admin File Review",
+    "DV Assessment",
+    "Attended Extra Class",
+    "Attended Free Class",
+    "Attended Intake Orientation",
+    "Bad Check Fee",
+    "Class Cancelled this Week",
+    "Completed Program",
+    "Complied with Referral Source Requirements",
+    "Convenience Fee",
+    "Court Appearance Subpoenaed",
+    "Co-Facilitated Class Session",
+    "DCS Court Appearance Subpoenaed",
+    "DCS FCM Team Meeting",
+    "DCS Individual Session",
+    "DCS Intake Orientation 1.0 Hour",
+    "DCS Non Credit Class Arrived Late ",
+    "DCS Non Credit Class Left Early ",
+    "DCS Non Credit Class Rule Violation",
+    "DCS Referral Ended / Withdrawn",
+    "Error",
+    "Emailed Participant",
+    "Excused Absence Court",
+    "Excused Absence Incarcerated",
+    "Excused Absence Medical",
+    "Excused Absence Military Duty",
+    "Facilitated Class Session",
+    "Individual Office Discussion",
+    "Late Fee",
+    "No Show- Client Never Enrolled",
+    "No Show - Scheduled Appointment",
+    "Non Credit - Arrived Late",
+    "Non Credit - Came to Office Intoxicated",
+    "Non Credit - Deferred",
+    "Non Credit - Left Early",
+    "Non Credit - Program Rule Violated",
+    "Non Credit - Short 12 Step Reports",
+    "Non Credit- Disruptive Behavior in Class",
+    "Non Credit-Zoom",
+    "Observed Class ",
+    "Other (specify)",
+    "Payment - No Session Attended",
+    "Payment Refund",
+    "Previous Balance Brought Forward",
+    "Program Extended",
+    "Received New Referral",
+    "Received Notebook",
+    "Refused to Attend Intake Orientation",
+    "Refused to Sign Enrollment Agreement",
+    "Returned Check Fee",
+    "Scheduled Appointment",
+    "Telephone Discussion",
+    "Telephone Message Left",
+    "Threatened Suicide 911 Notified",
+    "Transferred From Another Program",
+    "Transferred to Another Program",
+    "Texts/ Emails Sent to Client",
+    "Texts/Emails Sent to Referral Source",
+    "Text/Email Received from Client",
+    "Unable to Contact Client",
+    "Unbillable Team Meeting",
+    "Violated Abusive Behavior Instructed to Leave",
+    "Violated Admitted Alcohol or Drug Use",
+    "Violated Disruptive Behavior in Class",
+    "Violated Excessive Absences",
+    "Violated New Abuse Allegations",
+    "Violated New Criminal Charge",
+    "Violated Positive Alcohol/Drug Test",
+    "Violated Program Rules",
+    "Violated Quit Attending",
+    "Violated Refused to Comply with Staff",
+    "Violated Rules - Abuse Outside of Class",
+    "Volunteer Work Credit",
+    "Waiting for Client to Come and Enroll",
+]
+
+OTHER = 0
+ATTENDANCE = 1
+DEFERRED = 2
+ABSENCE = 3
+NON_CREDIT = 4
+FEE = 5
+PAYMENT = 6
+VIOLATION = 7
+ADMINISTRATIVE = 8
+
+SERVICE_CATEGORY_CHOICES = [
+    (OTHER, "Other"),
+    (ATTENDANCE, "Attendance"),
+    (DEFERRED, "Deferred"),
+    (ABSENCE, "Absence"),
+    (NON_CREDIT, "Non Credit"),
+    (FEE, "Fee"),
+    (PAYMENT, "Payment"),
+    (VIOLATION, "Violation"),
+    (ADMINISTRATIVE, "Administrative"),
+]
+
+
+def categorize_service(desc):
+    """Maps a service description to one of SERVICE_CATEGORY_CHOICES"""
+    if "Attended Class" in desc:
+        return ATTENDANCE
+    if "Deferred" in desc:
+        return DEFERRED
+    if desc.startswith("Violated"):
+        return VIOLATION
+    if "Non Credit" in desc:
+        return NON_CREDIT
+    if "Absen" in desc or "No Show" in desc:
+        return ABSENCE
+    if "Fee" in desc or desc == "Previous Balance Brought Forward":
+        return FEE
+    if desc.startswith("Payment"):
+        return PAYMENT
+    if desc in SERVICES and desc not in ("Error", "Other (specify)"):
+        return ADMINISTRATIVE
+    return OTHER
+
+
+def backfill_service_categories(apps, schema_editor):
+    # One UPDATE per distinct description rather than one per service
+    Service = apps.get_model("records", "Service")
+    descriptions = Service.objects.values_list("desc", flat=True).distinct()
+    for desc in descriptions:
+        category = categorize_service(desc)
+        if category != OTHER:
+            Service.objects.filter(desc=desc).update(category=category)
+
+
+class Migration(migrations.Migration):
+    # Point this at the latest records migration when copying into the project
+    dependencies = [
+        ("records", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="service",
+            name="category",
+            field=models.PositiveSmallIntegerField(
+                choices=SERVICE_CATEGORY_CHOICES,
+                default=OTHER,
+                editable=False,
+                verbose_name="Category",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="service",
+            index=models.Index(
+                fields=["client", "category", "date"],
+                name="service_client_category_date",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="service",
+            index=models.Index(
+                fields=["category", "date"], name="service_category_date"
+            ),
+        ),
+        migrations.RunPython(backfill_service_categories, migrations.RunPython.noop),
+    ]
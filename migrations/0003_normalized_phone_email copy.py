@@ -0,0 +1,56 @@
+from django.db import migrations, models
+
+# Frozen copies of the column sizes and normalize helpers as of this migration,
+# so later changes to records.models cannot change the backfill
+MAX_EMAIL = 64
+MAX_PHONE = 22
+
+
+def normalize_phone(phone):
+    """Digits only, so "(765) 555-0100" and "765.555.0100" match"""
+    return "".join(char for char in phone if char.isdigit())
+
+
+def normalize_email(email):
+    return email.strip().lower()
+
+
+def backfill_normalized_columns(apps, schema_editor):
+    for model_name in ("Client", "Referral"):
+        Model = apps.get_model("records", model_name)
+        rows = []
+        for row in Model.objects.only("pk", "phone", "email").iterator(chunk_size=2000):
+            row.phone_digits = normalize_phone(row.phone)
+            row.email_lower = normalize_email(row.email)
+            rows.append(row)
+            if len(rows) == 2000:
+                Model.objects.bulk_update(rows, ["phone_digits", "email_lower"])
+                rows = []
+        Model.objects.bulk_update(rows, ["phone_digits", "email_lower"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("records", "0002_service_category"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name=model_name,
+            name=name,
+            field=models.CharField(
+                blank=True,
+                db_index=True,
+                editable=False,
+                max_length=max_length,
+                verbose_name=verbose_name,
+            ),
+        )
+        for model_name in ("client", "referral")
+        for name, max_length, verbose_name in (
+            ("phone_digits", MAX_PHONE, "Phone Digits"),
+            ("email_lower", MAX_EMAIL, "Email Lowercase"),
+        )
+    ] + [
+        migrations.RunPython(backfill_normalized_columns, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,77 @@
+from django.db import migrations
+
+# Frozen copies of the indexed columns and the FTS5 table layout as of this
+# migration, so later changes to records.fulltext cannot change what it builds
+FULLTEXT_FIELDS = {
+    "Client": [
+        "f_name",
+        "m_name",
+        "l_name",
+        "email",
+        "phone",
+        "phone_digits",
+        "cause",
+        "cause2",
+        "cause3",
+    ],
+    "Referral": ["full_name", "agency", "email"],
+}
+
+
+def create_table(cursor, model_table, columns):
+    cursor.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {model_table}_fts "
+        f"USING fts5({', '.join(columns)}, prefix='2 3')"
+    )
+
+
+def fill_table(cursor, model_table, columns, rows):
+    """Inserts (pk, *columns) rows, replacing any already indexed"""
+    rows = list(rows)
+    cursor.executemany(
+        f"DELETE FROM {model_table}_fts WHERE rowid = %s",
+        [[row[0]] for row in rows],
+    )
+    cursor.executemany(
+        f"INSERT INTO {model_table}_fts (rowid, {', '.join(columns)}) "
+        f"VALUES ({', '.join(['%s'] * (len(columns) + 1))})",
+        rows,
+    )
+
+
+def create_fulltext_tables(apps, schema_editor):
+    # Other databases fall back to icontains unless a backend is configured
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for model_name, columns in FULLTEXT_FIELDS.items():
+            Model = apps.get_model("records", model_name)
+            table = Model._meta.db_table
+            create_table(cursor, table, columns)
+            fill_table(
+                cursor,
+                table,
+                columns,
+                Model.objects.filter(deleted=False)
+                .values_list("pk", *columns)
+                .iterator(chunk_size=2000),
+            )
+
+
+def drop_fulltext_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for model_name in FULLTEXT_FIELDS:
+            table = apps.get_model("records", model_name)._meta.db_table
+            cursor.execute(f"DROP TABLE IF EXISTS {table}_fts")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("records", "0003_normalized_phone_email"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fulltext_tables, drop_fulltext_tables),
+    ]
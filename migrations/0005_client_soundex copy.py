@@ -0,0 +1,70 @@
+from django.db import migrations, models
+
+# Frozen copy of the soundex helper as of this migration, so later changes to
+# records.models cannot change the backfill
+SOUNDEX_CODES = {
+    **dict.fromkeys("bfpv", "1"),
+    **dict.fromkeys("cgjkqsxz", "2"),
+    **dict.fromkeys("dt", "3"),
+    "l": "4",
+    **dict.fromkeys("mn", "5"),
+    "r": "6",
+}
+
+
+def soundex(name):
+    """American Soundex of a name, e.g. "Robert" and "Rupert" -> R163, "" for no letters"""
+    letters = [char for char in name.lower() if "a" <= char <= "z"]
+    if not letters:
+        return ""
+    code = letters[0].upper()
+    previous = SOUNDEX_CODES.get(letters[0], "")
+    for char in letters[1:]:
+        digit = SOUNDEX_CODES.get(char, "")
+        if digit and digit != previous:
+            code += digit
+            if len(code) == 4:
+                break
+        # H and W do not separate letters with the same code; vowels do
+        if char not in "hw":
+            previous = digit
+    return code.ljust(4, "0")
+
+
+def backfill_soundex(apps, schema_editor):
+    Client = apps.get_model("records", "Client")
+    rows = []
+    for row in Client.objects.only("pk", "f_name", "l_name").iterator(chunk_size=2000):
+        row.f_name_soundex = soundex(row.f_name)
+        row.l_name_soundex = soundex(row.l_name)
+        rows.append(row)
+        if len(rows) == 2000:
+            Client.objects.bulk_update(rows, ["f_name_soundex", "l_name_soundex"])
+            rows = []
+    Client.objects.bulk_update(rows, ["f_name_soundex", "l_name_soundex"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("records", "0004_fulltext_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="client",
+            name=name,
+            field=models.CharField(
+                blank=True,
+                db_index=True,
+                editable=False,
+                max_length=4,
+                verbose_name=verbose_name,
+            ),
+        )
+        for name, verbose_name in (
+            ("f_name_soundex", "First Name Soundex"),
+            ("l_name_soundex", "Last Name Soundex"),
+        )
+    ] + [
+        migrations.RunPython(backfill_soundex, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,129 @@
+from django.db import migrations, models
+
+# Frozen copy of the service categories as of this migration, so later changes to
+# records.models cannot change the schema it creates
+SERVICE_CATEGORY_CHOICES = [
+    (0, "Other"),
+    (1, "Attendance"),
+    (2, "Deferred"),
+    (3, "Absence"),
+    (4, "Non Credit"),
+    (5, "Fee"),
+    (6, "Payment"),
+    (7, "Violation"),
+    (8, "Administrative"),
+]
+
+
+def mark_existing_months(apps, schema_editor):
+    # Every month with services starts out dirty, so the first refresh builds it
+    Service = apps.get_model("records", "Service")
+    RollupDirtyMonth = apps.get_model("records", "RollupDirtyMonth")
+    RollupDirtyMonth.objects.bulk_create(
+        [
+            RollupDirtyMonth(month=month)
+            for month in Service.objects.dates("date", "month")
+        ]
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("records", "0005_client_soundex"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="service",
+            index=models.Index(fields=["date"], name="service_date"),
+        ),
+        migrations.CreateModel(
+            name="MonthlyRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "location",
+                    models.CharField(
+                        blank=True, max_length=50, verbose_name="Location"
+                    ),
+                ),
+                ("month", models.DateField(verbose_name="Month")),
+                (
+                    "category",
+                    models.PositiveSmallIntegerField(
+                        blank=True,
+                        choices=SERVICE_CATEGORY_CHOICES,
+                        null=True,
+                        verbose_name="Category",
+                    ),
+                ),
+                ("services", models.IntegerField(default=0, verbose_name="Services")),
+                (
+                    "clients",
+                    models.IntegerField(default=0, verbose_name="Active Clients"),
+                ),
+                (
+                    "attended",
+                    models.IntegerField(default=0, verbose_name="Classes Attended"),
+                ),
+                ("credits", models.IntegerField(default=0, verbose_name="Credits")),
+                (
+                    "fees",
+                    models.DecimalField(
+                        decimal_places=2, default=0, max_digits=12, verbose_name="Fees"
+                    ),
+                ),
+                (
+                    "discounts",
+                    models.DecimalField(
+                        decimal_places=2,
+                        default=0,
+                        max_digits=12,
+                        verbose_name="Discounts",
+                    ),
+                ),
+                (
+                    "payments",
+                    models.DecimalField(
+                        decimal_places=2,
+                        default=0,
+                        max_digits=12,
+                        verbose_name="Payments",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["month", "location"], name="rollup_month_location"
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="monthlyrollup",
+            constraint=models.UniqueConstraint(
+                fields=("location", "month", "category"), name="rollup_unique_key"
+            ),
+        ),
+        migrations.CreateModel(
+            name="RollupDirtyMonth",
+            fields=[
+                (
+                    "month",
+                    models.DateField(
+                        primary_key=True, serialize=False, verbose_name="Month"
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunPython(mark_existing_months, migrations.RunPython.noop),
+    ]
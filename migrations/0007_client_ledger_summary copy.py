@@ -0,0 +1,75 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # The table starts empty; fill it with `manage.py ledger_summary` after migrating
+    dependencies = [
+        ("records", "0006_monthly_rollup"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ClientLedgerSummary",
+            fields=[
+                (
+                    "client",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="ledger_summary",
+                        serialize=False,
+                        to="records.client",
+                    ),
+                ),
+                ("credits", models.IntegerField(default=0, verbose_name="Credits")),
+                (
+                    "fees",
+                    models.DecimalField(
+                        decimal_places=2, default=0, max_digits=12, verbose_name="Fees"
+                    ),
+                ),
+                (
+                    "discounts",
+                    models.DecimalField(
+                        decimal_places=2,
+                        default=0,
+                        max_digits=12,
+                        verbose_name="Discounts",
+                    ),
+                ),
+                (
+                    "payments",
+                    models.DecimalField(
+                        decimal_places=2,
+                        default=0,
+                        max_digits=12,
+                        verbose_name="Payments",
+                    ),
+                ),
+                (
+                    "balance",
+                    models.DecimalField(
+                        decimal_places=2,
+                        default=0,
+                        max_digits=12,
+                        verbose_name="Balance",
+                    ),
+                ),
+                (
+                    "sessions_left",
+                    models.IntegerField(default=0, verbose_name="Sessions Remaining"),
+                ),
+                (
+                    "last_service_date",
+                    models.DateField(
+                        blank=True, null=True, verbose_name="Last Service Date"
+                    ),
+                ),
+                (
+                    "last_updated",
+                    models.DateTimeField(auto_now=True, verbose_name="Last Updated"),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,39 @@
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("records", "0007_client_ledger_summary"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="client",
+            index=models.Index(
+                django.db.models.functions.text.Upper("l_name"),
+                name="client_upper_l_name",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="client",
+            index=models.Index(
+                django.db.models.functions.text.Upper("f_name"),
+                name="client_upper_f_name",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="referral",
+            index=models.Index(
+                django.db.models.functions.text.Upper("agency"),
+                name="referral_upper_agency",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="referral",
+            index=models.Index(
+                django.db.models.functions.text.Upper("full_name"),
+                name="referral_upper_full_name",
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("records", "0008_upper_name_indexes"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="client",
+            index=models.Index(fields=["l_name", "id"], name="client_l_name_id"),
+        ),
+        migrations.AddIndex(
+            model_name="referral",
+            index=models.Index(fields=["agency", "id"], name="referral_agency_id"),
+        ),
+    ]
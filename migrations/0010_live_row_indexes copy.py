@@ -0,0 +1,43 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Searches only read live rows, so the keyset indexes skip soft-deleted ones
+    dependencies = [
+        ("records", "0009_keyset_indexes"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="client",
+            name="client_l_name_id",
+        ),
+        migrations.RemoveIndex(
+            model_name="referral",
+            name="referral_agency_id",
+        ),
+        migrations.AddIndex(
+            model_name="client",
+            index=models.Index(
+                condition=models.Q(("deleted", False)),
+                fields=["l_name", "id"],
+                name="client_live_l_name_id",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="referral",
+            index=models.Index(
+                condition=models.Q(("deleted", False)),
+                fields=["agency", "id"],
+                name="referral_live_agency_id",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="service",
+            index=models.Index(
+                condition=models.Q(("deleted", False)),
+                fields=["client", "date"],
+                name="service_live_client_date",
+            ),
+        ),
+    ]
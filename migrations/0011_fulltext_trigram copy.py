@@ -0,0 +1,115 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Frozen copies of the indexed columns and the FTS5 table layout as of this
+# migration, so later changes to records.fulltext cannot change what it builds
+FULLTEXT_FIELDS = {
+    "Client": [
+        "f_name",
+        "m_name",
+        "l_name",
+        "email",
+        "phone",
+        "phone_digits",
+        "cause",
+        "cause2",
+        "cause3",
+    ],
+    "Referral": ["full_name", "agency", "email"],
+}
+
+# The trigram tokenizer needs SQLite 3.34; older versions keep icontains searches
+TRIGRAM_SQLITE_VERSION = (3, 34, 0)
+
+TRIGRAM = "tokenize='trigram'"
+PREFIX = "prefix='2 3'"
+
+
+def rebuild_fulltext_tables(apps, schema_editor, options):
+    connection = schema_editor.connection
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for model_name, columns in FULLTEXT_FIELDS.items():
+            Model = apps.get_model("records", model_name)
+            table = f"{Model._meta.db_table}_fts"
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
+            if (
+                options == TRIGRAM
+                and connection.Database.sqlite_version_info < TRIGRAM_SQLITE_VERSION
+            ):
+                continue
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE {table} "
+                f"USING fts5({', '.join(columns)}, {options})"
+            )
+            cursor.executemany(
+                f"INSERT INTO {table} (rowid, {', '.join(columns)}) "
+                f"VALUES ({', '.join(['%s'] * (len(columns) + 1))})",
+                Model.objects.filter(deleted=False)
+                .values_list("pk", *columns)
+                .iterator(chunk_size=2000),
+            )
+
+
+def use_trigrams(apps, schema_editor):
+    # Trigram tables match text anywhere in a column, as the icontains searches did
+    rebuild_fulltext_tables(apps, schema_editor, TRIGRAM)
+
+
+def use_prefixes(apps, schema_editor):
+    rebuild_fulltext_tables(apps, schema_editor, PREFIX)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("records", "0010_live_row_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(use_trigrams, use_prefixes),
+        migrations.CreateModel(
+            name="ClientFullText",
+            fields=[
+                ("rank", models.FloatField()),
+                (
+                    "client",
+                    models.OneToOneField(
+                        db_column="rowid",
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        primary_key=True,
+                        related_name="fulltext",
+                        serialize=False,
+                        to="records.client",
+                    ),
+                ),
+                ("match", models.TextField(db_column="records_client_fts")),
+            ],
+            options={
+                "db_table": "records_client_fts",
+                "managed": False,
+            },
+        ),
+        migrations.CreateModel(
+            name="ReferralFullText",
+            fields=[
+                ("rank", models.FloatField()),
+                (
+                    "referral",
+                    models.OneToOneField(
+                        db_column="rowid",
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        primary_key=True,
+                        related_name="fulltext",
+                        serialize=False,
+                        to="records.referral",
+                    ),
+                ),
+                ("match", models.TextField(db_column="records_referral_fts")),
+            ],
+            options={
+                "db_table": "records_referral_fts",
+                "managed": False,
+            },
+        ),
+    ]
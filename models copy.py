@@ -1,10 +1,29 @@
 import datetime
 import secrets
 import string
+import time
 import uuid
+from decimal import Decimal
+from functools import reduce
+from operator import or_
 
 
-from django.db import models
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models import (
+    Count,
+    Exists,
+    ExpressionWrapper,
+    F,
+    Max,
+    OuterRef,
+    Q,
+    Sum,
+    Value,
+)
+from django.db.models.functions import Coalesce, TruncMonth, Upper
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import Signal, receiver
 from django.utils import timezone
 from django.contrib import admin
 from django.core.validators import MinValueValidator
@@ -124,6 +143,55 @@ SERVICES = [
 ]
 SERVICE_CHOICES = [tuple([service, service]) for service in SERVICES]
 
+# Service categories, stored on Service.category so reports can filter on an
+# indexed integer instead of scanning desc with LIKE '%...%'
+OTHER = 0
+ATTENDANCE = 1
+DEFERRED = 2
+ABSENCE = 3
+NON_CREDIT = 4
+FEE = 5
+PAYMENT = 6
+VIOLATION = 7
+ADMINISTRATIVE = 8
+
+SERVICE_CATEGORY_CHOICES = [
+    (OTHER, "Other"),
+    (ATTENDANCE, "Attendance"),
+    (DEFERRED, "Deferred"),
+    (ABSENCE, "Absence"),
+    (NON_CREDIT, "Non Credit"),
+    (FEE, "Fee"),
+    (PAYMENT, "Payment"),
+    (VIOLATION, "Violation"),
+    (ADMINISTRATIVE, "Administrative"),
+]
+
+# Services that count as attending class (see Client.attended_class)
+ATTENDED_CATEGORIES = [ATTENDANCE, DEFERRED]
+
+
+def categorize_service(desc):
+    """Maps a service description to one of SERVICE_CATEGORY_CHOICES"""
+    if "Attended Class" in desc:
+        return ATTENDANCE
+    if "Deferred" in desc:
+        return DEFERRED
+    if desc.startswith("Violated"):
+        return VIOLATION
+    if "Non Credit" in desc:
+        return NON_CREDIT
+    if "Absen" in desc or "No Show" in desc:
+        return ABSENCE
+    if "Fee" in desc or desc == "Previous Balance Brought Forward":
+        return FEE
+    if desc.startswith("Payment"):
+        return PAYMENT
+    if desc in SERVICES and desc not in ("Error", "Other (specify)"):
+        return ADMINISTRATIVE
+    return OTHER
+
+
 FEES = [0.00, 2.00, 4.00, 8.00, 25.00, 30.00, 35.00, 40.00]
 FEE_CHOICES = [tuple([f"{fee:.2f}", f"{fee:.2f}"]) for fee in FEES]
 
@@ -191,12 +259,182 @@ def generate_passcode():
     )
 
 
-class Client(models.Model):
+def client_display_name(f_name, m_name, l_name):
+    if m_name:
+        return f"{f_name} {m_name} {l_name}".title()
+    else:
+        return f"{f_name} {l_name}".title()
+
+
+def normalize_phone(phone):
+    """Digits only, so "(765) 555-0100" and "765.555.0100" match"""
+    return "".join(char for char in phone if char.isdigit())
+
+
+def normalize_email(email):
+    return email.strip().lower()
+
+
+SOUNDEX_CODES = {
+    **dict.fromkeys("bfpv", "1"),
+    **dict.fromkeys("cgjkqsxz", "2"),
+    **dict.fromkeys("dt", "3"),
+    "l": "4",
+    **dict.fromkeys("mn", "5"),
+    "r": "6",
+}
+
+
+def soundex(name):
+    """American Soundex of a name, e.g. "Robert" and "Rupert" -> R163, "" for no letters"""
+    letters = [char for char in name.lower() if "a" <= char <= "z"]
+    if not letters:
+        return ""
+    code = letters[0].upper()
+    previous = SOUNDEX_CODES.get(letters[0], "")
+    for char in letters[1:]:
+        digit = SOUNDEX_CODES.get(char, "")
+        if digit and digit != previous:
+            code += digit
+            if len(code) == 4:
+                break
+        # H and W do not separate letters with the same code; vowels do
+        if char not in "hw":
+            previous = digit
+    return code.ljust(4, "0")
+
+
+# Money totals can exceed the max_digits of a single Service column
+LEDGER_DECIMAL = models.DecimalField(max_digits=12, decimal_places=2)
+CENTS = Decimal("0.01")
+
+
+class LedgerAmount(ExpressionWrapper):
+    """
+    A money expression typed as LEDGER_DECIMAL. SQLite only quantizes plain
+    columns, so sums and arithmetic come back as e.g. Decimal("-15"); these are
+    quantized to cents so every backend returns Decimal("-15.00").
+    """
+
+    def __init__(self, expression):
+        super().__init__(expression, output_field=LEDGER_DECIMAL)
+
+    def convert_value(self, value, expression, connection):
+        return None if value is None else Decimal(value).quantize(CENTS)
+
+
+def ledger_sum(field, zero, output_field):
+    """Sums a Service column over a client's non-deleted services, zero when there are none"""
+    return Coalesce(
+        Sum(f"service__{field}", filter=Q(service__deleted=False)),
+        Value(zero),
+        output_field=output_field,
+    )
+
+
+def ledger_amount(field):
+    """ledger_sum of a money column, quantized to cents"""
+    return LedgerAmount(ledger_sum(field, Decimal("0.00"), LEDGER_DECIMAL))
+
+
+def attendance_q(start_date, end_date):
+    """Matches services that count as attending class between the two dates"""
+    return Q(date__range=(start_date, end_date), category__in=ATTENDED_CATEGORIES)
+
+
+class SoftDeleteManager(models.Manager):
+    """Default manager of soft-deletable models, which hides rows marked deleted"""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted=False)
+
+
+class SoftDeleteModel(models.Model):
+    # Subclasses declare their own deleted/deleted_on/deleted_by fields.
+    # objects hides deleted rows; all_objects is the escape hatch that includes them.
+    objects = SoftDeleteManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        abstract = True
+
+
+def allowed_locations(user):
+    """
+    Locations whose clients the user may see, from the records.<location> permissions,
+    or None when they hold records.all_clients. Cached on the user object.
+    """
+    if not hasattr(user, "_records_locations"):
+        if user.has_perm("records.all_clients"):
+            user._records_locations = None
+        else:
+            user._records_locations = [
+                location
+                for location in LOCATIONS
+                if user.has_perm(f"records.{location.lower()}")
+            ]
+    return user._records_locations
+
+
+class ClientQuerySet(models.QuerySet):
+    def visible_to(self, user):
+        """Restricts the queryset to the locations the user has permission to see"""
+        locations = allowed_locations(user)
+        if locations is None:
+            return self
+        return self.filter(primary_location__in=locations)
+
+    def with_ledger_totals(self):
+        """Annotates credits, payments, fees, discounts, sessions left and balance in one query"""
+        return self.annotate(
+            ledger_credits=ledger_sum("credit", 0, models.IntegerField()),
+            ledger_payments=ledger_amount("payment"),
+            ledger_fees=ledger_amount("fee"),
+            ledger_discounts=ledger_amount("discount"),
+        ).annotate(
+            ledger_sessions_left=F("sesh_qty_orig")
+            + F("session_qty_add")
+            - F("ledger_credits"),
+            ledger_balance=LedgerAmount(
+                F("ledger_discounts") + F("ledger_payments") - F("ledger_fees")
+            ),
+        )
+
+    def missed_class(self, start_date, end_date):
+        """Clients with no attendance between the two dates, as a single NOT EXISTS query"""
+        attended = Service.objects.filter(
+            attendance_q(start_date, end_date), client=OuterRef("pk")
+        )
+        return self.filter(~Exists(attended))
+
+    def with_last_service_date(self):
+        """Annotates the date of each client's most recent non-deleted service"""
+        return self.annotate(
+            ledger_last_service_date=Max(
+                "service__date", filter=Q(service__deleted=False)
+            )
+        )
+
+
+class Client(SoftDeleteModel):
     class Meta:
         permissions = [
             ("lafayette", "Can see clients from Lafayette"),
             ("all_clients", "Can see all clients regardless of location"),
         ]
+        # Serve the case-insensitive exact and prefix lookups used by search
+        indexes = [
+            models.Index(Upper("l_name"), name="client_upper_l_name"),
+            models.Index(Upper("f_name"), name="client_upper_f_name"),
+            models.Index(
+                fields=["l_name", "id"],
+                name="client_live_l_name_id",
+                condition=Q(deleted=False),
+            ),
+        ]
+
+    objects = SoftDeleteManager.from_queryset(ClientQuerySet)()
+    all_objects = ClientQuerySet.as_manager()
 
     # Client Personal/Case/Program Information
     f_name = models.CharField("First Name", max_length=MAX_NAME)  # Required
@@ -204,6 +442,24 @@ class Client(models.Model):
     l_name = models.CharField("Last Name", max_length=MAX_NAME)  # Required
     phone = models.CharField("Phone Number", max_length=MAX_PHONE, blank=True)
     email = models.CharField("Email", max_length=MAX_EMAIL, blank=True)
+    # Normalized copies of phone and email for indexed search, set on save
+    phone_digits = models.CharField(
+        "Phone Digits", max_length=MAX_PHONE, blank=True, editable=False, db_index=True
+    )
+    email_lower = models.CharField(
+        "Email Lowercase",
+        max_length=MAX_EMAIL,
+        blank=True,
+        editable=False,
+        db_index=True,
+    )
+    # Phonetic keys for "sounds like" searches
+    f_name_soundex = models.CharField(
+        "First Name Soundex", max_length=4, blank=True, editable=False, db_index=True
+    )
+    l_name_soundex = models.CharField(
+        "Last Name Soundex", max_length=4, blank=True, editable=False, db_index=True
+    )
     dcs = models.BooleanField("DCS Client", null=True)
 
     primary_location = models.CharField(
@@ -283,10 +539,18 @@ class Client(models.Model):
 
     # Client methods
     def __str__(self):
-        if self.m_name:
-            return f"{self.f_name} {self.m_name} {self.l_name}".title()
-        else:
-            return f"{self.f_name} {self.l_name}".title()
+        return client_display_name(self.f_name, self.m_name, self.l_name)
+
+    def fill_derived_fields(self):
+        """Sets the lookup columns computed from other fields (bulk_create skips save)"""
+        self.phone_digits = normalize_phone(self.phone)
+        self.email_lower = normalize_email(self.email)
+        self.f_name_soundex = soundex(self.f_name)
+        self.l_name_soundex = soundex(self.l_name)
+
+    def save(self, *args, **kwargs):
+        self.fill_derived_fields()
+        super().save(*args, **kwargs)  # Call the "real" save() method.
 
     @admin.display(
         boolean=False,
@@ -294,7 +558,9 @@ class Client(models.Model):
     )
     def credits(self):
         """Computes the total credit a client has earned"""
-        services = Service.objects.filter(client=self.pk, deleted=False)
+        if hasattr(self, "ledger_credits"):
+            return self.ledger_credits
+        services = Service.objects.filter(client=self.pk)
         credits = 0
         for service in services:
             if service.credit is not None and not 0:
@@ -304,7 +570,9 @@ class Client(models.Model):
 
     def payments(self):
         """Computers the total amount a client has payed"""
-        services = Service.objects.filter(client=self.pk, deleted=False)
+        if hasattr(self, "ledger_payments"):
+            return self.ledger_payments
+        services = Service.objects.filter(client=self.pk)
         payments = 0
         for service in services:
             if service.payment is not None and not 0:
@@ -313,7 +581,9 @@ class Client(models.Model):
 
     def fees(self):
         """Computes the total amount a client owes in fees"""
-        services = Service.objects.filter(client=self.pk, deleted=False)
+        if hasattr(self, "ledger_fees"):
+            return self.ledger_fees
+        services = Service.objects.filter(client=self.pk)
         fees = 0
         for service in services:
             if service.fee is not None and not 0:
@@ -322,7 +592,9 @@ class Client(models.Model):
 
     def discounts(self):
         """Computer the total amount of discounts a client has received"""
-        services = Service.objects.filter(client=self.pk, deleted=False)
+        if hasattr(self, "ledger_discounts"):
+            return self.ledger_discounts
+        services = Service.objects.filter(client=self.pk)
         discounts = 0
         for service in services:
             if service.discount is not None and not 0:
@@ -330,7 +602,9 @@ class Client(models.Model):
         return discounts
 
     def sessions_left(self):
-        services = Service.objects.filter(client=self.pk, deleted=False)
+        if hasattr(self, "ledger_sessions_left"):
+            return self.ledger_sessions_left
+        services = Service.objects.filter(client=self.pk)
         credits = 0
         for service in services:
             if service.credit is not None:
@@ -339,7 +613,9 @@ class Client(models.Model):
         return sessions_left
 
     def balance_remaining(self):
-        services = Service.objects.filter(client=self.pk, deleted=False)
+        if hasattr(self, "ledger_balance"):
+            return self.ledger_balance
+        services = Service.objects.filter(client=self.pk)
         fees = 0
         discounts = 0
         payments = 0
@@ -356,18 +632,10 @@ class Client(models.Model):
         return balance
 
     def attended_class(self, start_date, end_date):
-        classes_attended = self.service_set.filter(
-            desc__contains="Attended Class", date__range=(start_date, end_date)
-        ) | self.service_set.filter(
-            desc__contains="Deferred", date__range=(start_date, end_date)
-        )
-        if classes_attended.count() > 0:
-            return True
-        else:
-            return False
+        return self.service_set.filter(attendance_q(start_date, end_date)).exists()
 
 
-class Service(models.Model):
+class Service(SoftDeleteModel):
     # Services and events that make up a Client Status Report. Foreign Key = Client
     """
     Backend Validators:
@@ -380,9 +648,28 @@ class Service(models.Model):
         credit : max
     """
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["client", "category", "date"],
+                name="service_client_category_date",
+            ),
+            models.Index(fields=["category", "date"], name="service_category_date"),
+            models.Index(fields=["date"], name="service_date"),
+            models.Index(
+                fields=["client", "date"],
+                name="service_live_client_date",
+                condition=Q(deleted=False),
+            ),
+        ]
+
     client = models.ForeignKey(Client, on_delete=models.CASCADE)
     date = models.DateField("Date", default="2000-01-01")
     desc = models.CharField("Description of Service", max_length=100, blank=True)
+    # Derived from desc on save
+    category = models.PositiveSmallIntegerField(
+        "Category", choices=SERVICE_CATEGORY_CHOICES, default=OTHER, editable=False
+    )
     fee = models.DecimalField(
         "Fee",
         max_digits=5,
@@ -427,8 +714,12 @@ class Service(models.Model):
     def __str__(self):
         return f"{self.client.__str__()}-{self.desc}-{self.date}"
 
+    def fill_derived_fields(self):
+        self.category = categorize_service(self.desc)
+
     def save(self, *args, **kwargs):
         try:
+            self.fill_derived_fields()
             self.full_clean()
             super().save(*args, **kwargs)  # Call the "real" save() method.
         except ValidationError as e:
@@ -439,7 +730,220 @@ class Service(models.Model):
         return now - datetime.timedelta(days=7) <= self.date <= now
 
 
-class CaseNote(models.Model):
+class ClientLedgerSummaryManager(models.Manager):
+    def refresh(self, client_ids=None):
+        """Recomputes the summary rows of the given clients (every client when None)"""
+        clients = Client.all_objects.all()
+        if client_ids is not None:
+            clients = clients.filter(pk__in=client_ids)
+        clients = clients.with_ledger_totals().with_last_service_date()
+        summaries = [self.model.from_client(client) for client in clients]
+        self.bulk_create(
+            summaries,
+            update_conflicts=True,
+            unique_fields=["client"],
+            update_fields=ClientLedgerSummary.TOTALS + ["last_updated"],
+        )
+        return len(summaries)
+
+
+class ClientLedgerSummary(models.Model):
+    # One row of precomputed ledger totals per client, kept in sync with the Service table
+    TOTALS = [
+        "credits",
+        "fees",
+        "discounts",
+        "payments",
+        "balance",
+        "sessions_left",
+        "last_service_date",
+    ]
+
+    client = models.OneToOneField(
+        Client,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="ledger_summary",
+    )
+    credits = models.IntegerField("Credits", default=0)
+    fees = models.DecimalField("Fees", max_digits=12, decimal_places=2, default=0)
+    discounts = models.DecimalField(
+        "Discounts", max_digits=12, decimal_places=2, default=0
+    )
+    payments = models.DecimalField(
+        "Payments", max_digits=12, decimal_places=2, default=0
+    )
+    balance = models.DecimalField("Balance", max_digits=12, decimal_places=2, default=0)
+    sessions_left = models.IntegerField("Sessions Remaining", default=0)
+    last_service_date = models.DateField("Last Service Date", blank=True, null=True)
+    last_updated = models.DateTimeField("Last Updated", auto_now=True)
+
+    objects = ClientLedgerSummaryManager()
+
+    def __str__(self):
+        return f"{self.client_id}-{self.balance}-{self.sessions_left}"
+
+    @classmethod
+    def from_client(cls, client):
+        """Builds an unsaved summary from a client annotated by with_ledger_totals()"""
+        return cls(
+            client_id=client.pk,
+            credits=client.ledger_credits,
+            fees=client.ledger_fees,
+            discounts=client.ledger_discounts,
+            payments=client.ledger_payments,
+            balance=client.ledger_balance,
+            sessions_left=client.ledger_sessions_left,
+            last_service_date=client.ledger_last_service_date,
+        )
+
+    def matches(self, other):
+        return all(
+            getattr(self, field) == getattr(other, field) for field in self.TOTALS
+        )
+
+
+def month_start(value):
+    """The first day of the month of a date (or date string)"""
+    return Service._meta.get_field("date").to_python(value).replace(day=1)
+
+
+def next_month(month):
+    return (month + datetime.timedelta(days=32)).replace(day=1)
+
+
+class MonthlyRollupManager(models.Manager):
+    def refresh(self, months=None):
+        """
+        Recomputes the rollups of the given months (every month when None) from the
+        live Service rows of live clients, replacing each month's rows as a whole
+        """
+        services = Service.objects.filter(client__deleted=False).order_by()
+        if months is not None:
+            months = sorted({month_start(month) for month in months})
+            if not months:
+                return 0
+            # One indexed date range per month, however far apart they are
+            services = services.filter(
+                reduce(
+                    or_,
+                    (
+                        Q(date__gte=month, date__lt=next_month(month))
+                        for month in months
+                    ),
+                )
+            )
+        services = services.annotate(
+            location=F("client__primary_location"), month=TruncMonth("date")
+        )
+
+        totals = {
+            "services": Count("id"),
+            "clients": Count("client", distinct=True),
+            "attended": Count("id", filter=Q(category__in=ATTENDED_CATEGORIES)),
+            "credits": Coalesce(Sum("credit"), Value(0)),
+            "fees": Coalesce(
+                Sum("fee"), Value(Decimal("0.00")), output_field=LEDGER_DECIMAL
+            ),
+            "discounts": Coalesce(
+                Sum("discount"), Value(Decimal("0.00")), output_field=LEDGER_DECIMAL
+            ),
+            "payments": Coalesce(
+                Sum("payment"), Value(Decimal("0.00")), output_field=LEDGER_DECIMAL
+            ),
+        }
+        # One row per category, plus a category-less row per location and month
+        # whose client count is distinct across categories
+        rollups = [
+            self.model(**row)
+            for row in services.values("location", "month", "category").annotate(
+                **totals
+            )
+        ] + [
+            self.model(category=None, **row)
+            for row in services.values("location", "month").annotate(**totals)
+        ]
+        with transaction.atomic():
+            stale = self.all() if months is None else self.filter(month__in=months)
+            stale.delete()
+            self.bulk_create(rollups, batch_size=1000)
+        return len(rollups)
+
+    def refresh_dirty(self):
+        """Refreshes only the months touched since the last refresh; returns them"""
+        with transaction.atomic():
+            dirty = RollupDirtyMonth.objects.select_for_update()
+            months = list(dirty.values_list("month", flat=True))
+            if months:
+                # Cleared first, so months touched while refreshing stay dirty
+                dirty.filter(month__in=months).delete()
+                self.refresh(months)
+        return months
+
+
+class MonthlyRollup(models.Model):
+    # Service ledger totals pre-aggregated by (location, month, service category),
+    # so reports read a few rows per month instead of every Service row
+    TOTALS = [
+        "services",
+        "clients",
+        "attended",
+        "credits",
+        "fees",
+        "discounts",
+        "payments",
+    ]
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["location", "month", "category"], name="rollup_unique_key"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["month", "location"], name="rollup_month_location")
+        ]
+
+    # The client's primary location when the month was last refreshed
+    location = models.CharField("Location", max_length=50, blank=True)
+    # First day of the month
+    month = models.DateField("Month")
+    # None on the row totalling every category
+    category = models.PositiveSmallIntegerField(
+        "Category", choices=SERVICE_CATEGORY_CHOICES, blank=True, null=True
+    )
+    services = models.IntegerField("Services", default=0)
+    # Distinct clients with a service; not additive across months or categories
+    clients = models.IntegerField("Active Clients", default=0)
+    attended = models.IntegerField("Classes Attended", default=0)
+    credits = models.IntegerField("Credits", default=0)
+    fees = models.DecimalField("Fees", max_digits=12, decimal_places=2, default=0)
+    discounts = models.DecimalField(
+        "Discounts", max_digits=12, decimal_places=2, default=0
+    )
+    payments = models.DecimalField(
+        "Payments", max_digits=12, decimal_places=2, default=0
+    )
+
+    objects = MonthlyRollupManager()
+
+    def __str__(self):
+        return f"{self.location}-{self.month:%Y-%m}-{self.get_category_display()}"
+
+
+class RollupDirtyMonth(models.Model):
+    # Months whose rollups are out of date since services in them changed
+    month = models.DateField("Month", primary_key=True)
+
+    @classmethod
+    def mark(cls, dates):
+        months = {month_start(date) for date in dates}
+        cls.objects.bulk_create(
+            [cls(month=month) for month in months], ignore_conflicts=True
+        )
+
+
+class CaseNote(SoftDeleteModel):
     # Case note entries that make up a Green Sheet. Foreign Key = Client
     client = models.ForeignKey(Client, on_delete=models.CASCADE)
     date = models.DateField("Date")
@@ -485,12 +989,35 @@ class CaseNote(models.Model):
             raise ValidationError("Start time is after end time.")
 
 
-class Referral(models.Model):
+class Referral(SoftDeleteModel):
+    class Meta:
+        # Serve the case-insensitive exact and prefix lookups used by search
+        indexes = [
+            models.Index(Upper("agency"), name="referral_upper_agency"),
+            models.Index(Upper("full_name"), name="referral_upper_full_name"),
+            models.Index(
+                fields=["agency", "id"],
+                name="referral_live_agency_id",
+                condition=Q(deleted=False),
+            ),
+        ]
+
     clients = models.ManyToManyField(Client)
     full_name = models.CharField("Referred by", max_length=MAX_NAME * 2)
     agency = models.CharField("Agency", max_length=50)
     phone = models.CharField("Phone Number", max_length=MAX_PHONE, blank=True)
     email = models.CharField("Email", max_length=MAX_EMAIL, blank=True)
+    # Normalized copies of phone and email for indexed search, set on save
+    phone_digits = models.CharField(
+        "Phone Digits", max_length=MAX_PHONE, blank=True, editable=False, db_index=True
+    )
+    email_lower = models.CharField(
+        "Email Lowercase",
+        max_length=MAX_EMAIL,
+        blank=True,
+        editable=False,
+        db_index=True,
+    )
 
     # Track when changes occur and who made them
     last_updated = models.DateTimeField("Last Updated", auto_now=True)
@@ -505,3 +1032,238 @@ class Referral(models.Model):
 
     def __str__(self):
         return self.agency
+
+    def fill_derived_fields(self):
+        self.phone_digits = normalize_phone(self.phone)
+        self.email_lower = normalize_email(self.email)
+
+    def save(self, *args, **kwargs):
+        self.fill_derived_fields()
+        super().save(*args, **kwargs)  # Call the "real" save() method.
+
+
+class FullTextEntry(models.Model):
+    """
+    A row of a model's SQLite FTS5 table (see records.fulltext), joined to the model
+    on rowid = pk so a search matches, ranks and filters in one query. The tables
+    are virtual tables created by the migrations, so Django does not manage them.
+    """
+
+    # bm25 score of the row for the query being matched, lower is better
+    rank = models.FloatField()
+
+    class Meta:
+        abstract = True
+
+
+class ClientFullText(FullTextEntry):
+    client = models.OneToOneField(
+        Client,
+        on_delete=models.DO_NOTHING,
+        primary_key=True,
+        db_column="rowid",
+        related_name="fulltext",
+    )
+    # FTS5's hidden column named after the table; comparing it with = runs a MATCH
+    match = models.TextField(db_column="records_client_fts")
+
+    class Meta:
+        managed = False
+        db_table = "records_client_fts"
+
+
+class ReferralFullText(FullTextEntry):
+    referral = models.OneToOneField(
+        Referral,
+        on_delete=models.DO_NOTHING,
+        primary_key=True,
+        db_column="rowid",
+        related_name="fulltext",
+    )
+    match = models.TextField(db_column="records_referral_fts")
+
+    class Meta:
+        managed = False
+        db_table = "records_referral_fts"
+
+
+# Sent with the instances written by one bulk_create(), which skips save() and
+# post_save. Receivers do the bookkeeping of their post_save counterparts once
+# per batch instead of once per row.
+bulk_saved = Signal()
+
+
+# Keep ClientLedgerSummary in sync. Refreshes run on commit so a batch of
+# services saved in one transaction, or a cascading client delete, is settled
+# before the client's row is recomputed.
+class PendingLedgerRefresh:
+    """The clients whose summaries are refreshed when the transaction commits"""
+
+    def __init__(self):
+        self.client_ids = set()
+
+    def __call__(self):
+        # The first callback of a commit refreshes every pending client; any others
+        # registered in the same transaction find nothing left to do
+        client_ids, self.client_ids = self.client_ids, set()
+        if client_ids:
+            ClientLedgerSummary.objects.refresh(sorted(client_ids))
+
+
+def refresh_ledger_summaries(client_ids):
+    """Refreshes each client's summary once per transaction, however often it is saved"""
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        ClientLedgerSummary.objects.refresh(sorted(set(client_ids)))
+        return
+    pending = getattr(connection, "pending_ledger_refresh", None)
+    if pending is None:
+        pending = connection.pending_ledger_refresh = PendingLedgerRefresh()
+    pending.client_ids.update(client_ids)
+    # Registered on every call, since a rollback silently drops callbacks. Clients
+    # left pending by a rolled back transaction are refreshed, harmlessly, with the
+    # next one to commit.
+    transaction.on_commit(pending)
+
+
+@receiver(post_save, sender=Service)
+@receiver(post_delete, sender=Service)
+def service_changed(sender, instance, **kwargs):
+    # Soft deletes are saves with deleted=True, so they are covered here too
+    refresh_ledger_summaries([instance.client_id])
+
+
+@receiver(post_save, sender=Client)
+def client_changed(sender, instance, **kwargs):
+    # sessions_left depends on the client's required and additional sessions
+    refresh_ledger_summaries([instance.pk])
+
+
+@receiver(bulk_saved, sender=Client)
+@receiver(bulk_saved, sender=Service)
+def ledger_bulk_saved(sender, instances, **kwargs):
+    refresh_ledger_summaries(
+        instance.pk if sender is Client else instance.client_id
+        for instance in instances
+    )
+
+
+# Mark the months a change touches, for MonthlyRollup.objects.refresh_dirty()
+@receiver(pre_save, sender=Service)
+def service_rollup_months(sender, instance, **kwargs):
+    # A service moved to another month leaves its old month stale too
+    dates = [instance.date]
+    if instance.pk:
+        dates += Service.all_objects.filter(pk=instance.pk).values_list(
+            "date", flat=True
+        )
+    RollupDirtyMonth.mark(dates)
+
+
+@receiver(post_delete, sender=Service)
+def service_deleted_rollup_month(sender, instance, **kwargs):
+    RollupDirtyMonth.mark([instance.date])
+
+
+@receiver(bulk_saved, sender=Service)
+def rollup_bulk_saved(sender, instances, **kwargs):
+    RollupDirtyMonth.mark(instance.date for instance in instances)
+
+
+@receiver(pre_save, sender=Client)
+def client_rollup_months(sender, instance, **kwargs):
+    # Rollups are keyed by location and leave out deleted clients, so a move or a
+    # (un)delete restates every month of the client
+    if instance.pk:
+        changed = (
+            Client.all_objects.filter(pk=instance.pk)
+            .exclude(
+                primary_location=instance.primary_location, deleted=instance.deleted
+            )
+            .exists()
+        )
+        if changed:
+            RollupDirtyMonth.mark(
+                Service.all_objects.filter(client_id=instance.pk).dates("date", "month")
+            )
+
+
+# Cached search results are keyed by these per-model counters, so any save or
+# delete invalidates them in O(1). Counters are seeded from the clock so one
+# lost from the cache never comes back with a value an old entry was keyed by.
+def search_version_key(model):
+    return f"records:search-version:{model._meta.model_name}"
+
+
+def search_version(model):
+    key = search_version_key(model)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+@receiver(post_save, sender=Client)
+@receiver(post_delete, sender=Client)
+@receiver(post_save, sender=Referral)
+@receiver(post_delete, sender=Referral)
+@receiver(post_save, sender=Service)
+@receiver(post_delete, sender=Service)
+@receiver(bulk_saved, sender=Client)
+@receiver(bulk_saved, sender=Referral)
+@receiver(bulk_saved, sender=Service)
+def bump_search_version(sender, **kwargs):
+    # After commit, so a search running meanwhile cannot cache the old rows under
+    # the new version
+    transaction.on_commit(lambda: increment_search_version(sender))
+
+
+def increment_search_version(model):
+    key = search_version_key(model)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), timeout=None)
+
+
+@receiver(m2m_changed, sender=Referral.clients.through)
+def referral_clients_changed(sender, action, **kwargs):
+    # Links have their own version (see analytics.ledger_version()), so linking
+    # clients does not invalidate cached referral searches, which ignore them
+    if action.startswith("post_"):
+        bump_search_version(sender)
+
+
+# Choice strings for ReferralSelectForm, cached per Referral search version, so a
+# saved or deleted referral moves readers to a new entry. Entries left behind by
+# older versions expire on their own.
+REFERRAL_CHOICES_KEY = "records:referral-choices"
+REFERRAL_CHOICES_TIMEOUT = 60 * 60 * 24
+
+
+def referral_choice_string(agency, full_name):
+    return f"{agency}--{full_name}"
+
+
+def referral_choices():
+    """The "agency--full_name" strings of every live referral, sorted"""
+    # The version is read before the rows, so a list built from rows older than a
+    # change is only ever stored under the version from before it
+    key = f"{REFERRAL_CHOICES_KEY}:{search_version(Referral)}"
+    choices = cache.get(key)
+    if choices is None:
+        choices = [
+            referral_choice_string(agency, full_name)
+            for agency, full_name in Referral.objects.order_by(
+                "agency", "full_name"
+            ).values_list("agency", "full_name")
+        ]
+        cache.set(key, choices, timeout=REFERRAL_CHOICES_TIMEOUT)
+    return choices
+
+
+# Connect the receivers that keep the full-text tables and the name index in step
+# with every write, including from processes that never import search (e.g.
+# management commands). Imported last, since both modules import from this one.
+from records import fulltext, name_index  # noqa: E402, F401
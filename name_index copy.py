@@ -0,0 +1,299 @@
+import sys
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+
+from django.db import connections, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from records.models import Client, Referral, bulk_saved, search_version
+
+
+def name_keys(*names):
+    """Normalized tokens an entry can be found by, e.g. ("Mary Ann", "Smith") -> mary, ann, smith"""
+    return [token for name in names for token in name.lower().split()]
+
+
+class NameEntry:
+    # One indexed client or referral; names keep their original case for display
+    __slots__ = ("id", "names", "location")
+
+    def __init__(self, id, names, location=None):
+        self.id = id
+        self.names = names
+        self.location = location
+
+
+class PrefixIndex:
+    """A sorted array of (name token, id) pairs, searched by prefix with bisect"""
+
+    def __init__(self, entries=()):
+        self.entries = {entry.id: entry for entry in entries}
+        pairs = sorted(
+            (key, entry.id)
+            for entry in self.entries.values()
+            for key in name_keys(*entry.names)
+        )
+        self.keys = [key for key, _ in pairs]
+        self.ids = array("q", (id for _, id in pairs))
+
+    def add(self, entry):
+        self.remove(entry.id)
+        self.entries[entry.id] = entry
+        for key in name_keys(*entry.names):
+            index = bisect_right(self.keys, key)
+            self.keys.insert(index, key)
+            self.ids.insert(index, entry.id)
+
+    def remove(self, id):
+        entry = self.entries.pop(id, None)
+        if entry is None:
+            return
+        for key in name_keys(*entry.names):
+            start = bisect_left(self.keys, key)
+            end = bisect_right(self.keys, key)
+            for index in range(start, end):
+                if self.ids[index] == id:
+                    del self.keys[index]
+                    del self.ids[index]
+                    break
+
+    def match(self, token):
+        """Ids of entries with a name token starting with token"""
+        ids = set()
+        index = bisect_left(self.keys, token)
+        while index < len(self.keys) and self.keys[index].startswith(token):
+            ids.add(self.ids[index])
+            index += 1
+        return ids
+
+    def search(self, tokens):
+        """Entries where every token prefixes one of their name tokens"""
+        ids = None
+        for token in tokens:
+            ids = self.match(token) if ids is None else ids & self.match(token)
+            if not ids:
+                return []
+        return [self.entries[id] for id in ids or ()]
+
+    def memory(self):
+        """Approximate bytes held by the index"""
+        return (
+            sys.getsizeof(self.keys)
+            + sum(sys.getsizeof(key) for key in self.keys)
+            + sys.getsizeof(self.ids)
+            + sys.getsizeof(self.entries)
+            + sum(
+                sys.getsizeof(entry) + sys.getsizeof(entry.names)
+                for entry in self.entries.values()
+            )
+        )
+
+
+def client_entry(id, f_name, l_name, location):
+    return NameEntry(id, (f_name, l_name), location)
+
+
+def referral_entry(id, full_name, agency):
+    return NameEntry(id, (full_name, agency))
+
+
+class NameIndex:
+    """
+    In-process prefix index of client and referral names for the typeahead.
+
+    Built lazily in a background thread on first use; lookups return None (and the
+    caller falls back to the database) until it is ready. Saves and deletes in this
+    process update it incrementally through signals once they commit. Each of those
+    moves the model's search version by one, so the stored version follows those
+    bumps only; any other movement means another process changed the names, and
+    the next lookup rebuilds the index.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.clients = None
+        self.referrals = None
+        self.versions = {}
+        self.building = False
+        self.pending = []
+        self.hits = 0
+        self.fallbacks = 0
+
+    def ensure_built(self):
+        with self.lock:
+            if self.building:
+                return
+            self.building = True
+        threading.Thread(target=self.build_in_thread, daemon=True).start()
+
+    def build_in_thread(self):
+        try:
+            self.build()
+        finally:
+            connections.close_all()
+
+    def build(self):
+        with self.lock:
+            self.building = True
+            self.pending = []
+        try:
+            versions = {model: search_version(model) for model in (Client, Referral)}
+            clients = PrefixIndex(
+                client_entry(*row)
+                for row in Client.objects.values_list(
+                    "id", "f_name", "l_name", "primary_location"
+                ).iterator(chunk_size=5000)
+            )
+            referrals = PrefixIndex(
+                referral_entry(*row)
+                for row in Referral.objects.values_list(
+                    "id", "full_name", "agency"
+                ).iterator(chunk_size=5000)
+            )
+        except Exception:
+            # Leave the index unbuilt so the next lookup retries
+            with self.lock:
+                self.building = False
+            raise
+        with self.lock:
+            self.clients = clients
+            self.referrals = referrals
+            self.versions = versions
+            # Replay changes that were committed while the snapshot was loading
+            for model, instances, removed in self.pending:
+                self.apply(model, instances, removed)
+                self.advance(model)
+            self.pending = []
+            self.building = False
+
+    def ready(self):
+        """True when the index is built and no other process has changed the names since"""
+        with self.lock:
+            if self.clients is None:
+                if not self.building:
+                    self.ensure_built()
+                return False
+            current = all(
+                search_version(model) == version
+                for model, version in self.versions.items()
+            )
+            if not current:
+                self.clients = self.referrals = None
+                self.ensure_built()
+            return current
+
+    def lookup_clients(self, tokens, locations, limit):
+        """Matches as dicts shaped like the typeahead's values() rows, or None if not ready"""
+        with self.lock:
+            if not self.ready():
+                self.fallbacks += 1
+                return None
+            matches = [
+                entry
+                for entry in self.clients.search(tokens)
+                if locations is None or entry.location in locations
+            ]
+            self.hits += 1
+        matches.sort(key=lambda entry: (entry.names[1], entry.id))
+        return [
+            {
+                "id": entry.id,
+                "f_name": entry.names[0],
+                "l_name": entry.names[1],
+                "primary_location": entry.location,
+            }
+            for entry in matches[:limit]
+        ]
+
+    def lookup_referrals(self, tokens, limit):
+        with self.lock:
+            if not self.ready():
+                self.fallbacks += 1
+                return None
+            matches = self.referrals.search(tokens)
+            self.hits += 1
+        matches.sort(key=lambda entry: (entry.names[1], entry.id))
+        return [
+            {"id": entry.id, "full_name": entry.names[0], "agency": entry.names[1]}
+            for entry in matches[:limit]
+        ]
+
+    def changed(self, model, instances, removed=False):
+        # On commit, so rolled back changes never reach the index
+        transaction.on_commit(lambda: self.committed(model, instances, removed))
+
+    def committed(self, model, instances, removed):
+        with self.lock:
+            if self.building:
+                self.pending.append((model, instances, removed))
+            elif self.clients is not None:
+                self.apply(model, instances, removed)
+                self.advance(model)
+
+    def apply(self, model, instances, removed):
+        index = self.clients if model is Client else self.referrals
+        for instance in instances:
+            if removed or instance.deleted:
+                index.remove(instance.pk)
+            elif model is Client:
+                index.add(
+                    client_entry(
+                        instance.pk,
+                        instance.f_name,
+                        instance.l_name,
+                        instance.primary_location,
+                    )
+                )
+            else:
+                index.add(
+                    referral_entry(instance.pk, instance.full_name, instance.agency)
+                )
+
+    def advance(self, model):
+        """
+        Follows the search version bump of one change applied from this process.
+        bump_search_version's on-commit increment was registered before ours (its
+        module is imported first), so it has already run. If the version moved by
+        anything else, the stored one is left behind and ready() rebuilds.
+        """
+        if search_version(model) == self.versions[model] + 1:
+            self.versions[model] += 1
+
+    def stats(self):
+        with self.lock:
+            built = self.clients is not None
+            lookups = self.hits + self.fallbacks
+            return {
+                "built": built,
+                "clients": len(self.clients.entries) if built else 0,
+                "referrals": len(self.referrals.entries) if built else 0,
+                "memory_bytes": (
+                    self.clients.memory() + self.referrals.memory() if built else 0
+                ),
+                "hits": self.hits,
+                "fallbacks": self.fallbacks,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+NAME_INDEX = NameIndex()
+
+
+@receiver(post_save, sender=Client)
+@receiver(post_save, sender=Referral)
+def name_saved(sender, instance, **kwargs):
+    NAME_INDEX.changed(sender, [instance])
+
+
+@receiver(bulk_saved, sender=Client)
+@receiver(bulk_saved, sender=Referral)
+def names_bulk_saved(sender, instances, **kwargs):
+    NAME_INDEX.changed(sender, list(instances))
+
+
+@receiver(post_delete, sender=Client)
+@receiver(post_delete, sender=Referral)
+def name_deleted(sender, instance, **kwargs):
+    NAME_INDEX.changed(sender, [instance], removed=True)
@@ -1,68 +1,219 @@
 import datetime
+import io
+import secrets
 from datetime import date
+from urllib.parse import urlencode
 
-from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
+from django.conf import settings
+from django.contrib.auth.decorators import login_required, permission_required
+from django.contrib.auth.mixins import (
+    LoginRequiredMixin,
+    PermissionRequiredMixin,
+    UserPassesTestMixin,
+)
 from django.contrib.auth.models import User
-from django.http import HttpResponseRedirect
+from django.http import (
+    HttpResponse,
+    HttpResponseForbidden,
+    HttpResponseRedirect,
+    JsonResponse,
+)
 from django.urls import reverse
 from django.views import generic
 from django.views.generic.base import TemplateView
+from records.analytics import available as analytics_available
+from records.analytics import ledger_snapshot
+from records.attendance import record_class_session
+from records.exports import export_clients, export_referrals, export_services
 from records.forms import (
+    AttendanceReportForm,
+    ClassSessionForm,
+    ImportForm,
+    MonthlyReportForm,
     SearchForm,
     UserProfileForm,
 )
-from records.models import Client, Referral
+from records.imports import IMPORTERS
+from records.instrumentation import metrics, metrics_text, query_budget
+from records.models import (
+    ACTIVE,
+    Client,
+    Referral,
+    Service,
+    allowed_locations,
+    referral_choices,
+)
+from records.reports import monthly_report
+from records.search import (
+    ClientRow,
+    ReferralRow,
+    ServiceRow,
+    cached_keyset_page,
+    result_keys,
+    search_clients_advanced,
+    search_clients_quick,
+    search_query_string,
+    search_referrals_advanced,
+    search_services_advanced,
+    search_typeahead,
+    tokenize,
+)
 
 
 class AttendanceReport(PermissionRequiredMixin, LoginRequiredMixin, generic.ListView):
     model = Client
     template_name = "records/reports/report-missed-class.html"
     permission_required = ("records.view_client", "records.view_service")
+    paginate_by = 50
+    default_days = 7
 
     def get_queryset(self):
+        # Date window and location come from the GET query string, defaulting to the past week
+        self.form = AttendanceReportForm(self.request.GET or None)
         end = date.today()
-        start = date.today() - datetime.timedelta(7)
-        active_clients = Client.objects.filter(current_status="A", deleted=False)
-        missed_class = [
-            client for client in active_clients if not client.attended_class(start, end)
-        ]
-        return missed_class
-
-
-def search_clients_advanced(contains=False, locations=(), status=(), **kwargs):
-    client_list = Client.objects.filter(deleted=False)
-    for key, value in kwargs.items():
-        if value != "" and value is not None:
-            if contains and isinstance(value, str):
-                key = key + "__contains"
-            client_list = client_list.filter(**{key: value})
-    client_list = multi_filter(client_list, "primary_location", locations, contains)
-    client_list = multi_filter(client_list, "current_status", status, contains)
-    return client_list.order_by("l_name")
-
-
-def multi_filter(client_list, field, field_list, contains):
-    if contains:
-        field = field + "__contains"
-    if field_list:
-        if len(field_list) > 0:
-            new_list = client_list.filter(**{field: field_list[0]})
+        start = end - datetime.timedelta(self.default_days)
+        location = ""
+        if self.form.is_valid():
+            end = self.form.cleaned_data["end"] or end
+            start = self.form.cleaned_data["start"] or end - datetime.timedelta(
+                self.default_days
+            )
+            location = self.form.cleaned_data["location"]
+
+        active_clients = Client.objects.visible_to(self.request.user).filter(
+            current_status=ACTIVE
+        )
+        if location:
+            active_clients = active_clients.filter(primary_location=location)
+        return active_clients.missed_class(start, end).order_by("l_name", "id")
+
+    def get_context_data(self, **kwargs):
+        context = super(AttendanceReport, self).get_context_data(**kwargs)
+        context["form"] = self.form
+        return context
+
+
+class AttendanceReportExport(AttendanceReport):
+    # Streams the whole report for the same filters as CSV, not just one page
+    def get(self, request, *args, **kwargs):
+        return export_clients("missed-class.csv", self.get_queryset())
+
+
+class MonthlyReport(PermissionRequiredMixin, LoginRequiredMixin, TemplateView):
+    template_name = "records/reports/report-monthly.html"
+    permission_required = ("records.view_client", "records.view_service")
+
+    def get_context_data(self, **kwargs):
+        context = super(MonthlyReport, self).get_context_data(**kwargs)
+        form = MonthlyReportForm(self.request.GET or None)
+        context["form"] = form
+        if form.is_valid():
+            # Locations are limited to those the user may see, like client searches
+            locations = allowed_locations(self.request.user)
+            location = form.cleaned_data["location"]
+            if location:
+                if locations is not None and location not in locations:
+                    locations = []
+                else:
+                    locations = [location]
+            if form.cleaned_data["all_time"]:
+                year = month = None
+            else:
+                year = form.cleaned_data["year"]
+                month = form.cleaned_data["month"]
+            context.update(monthly_report(year, month, locations))
+        return context
+
+
+class LedgerAnalytics(PermissionRequiredMixin, LoginRequiredMixin, TemplateView):
+    template_name = "records/reports/report-analytics.html"
+    permission_required = (
+        "records.view_client",
+        "records.view_service",
+        "records.view_referral",
+    )
+
+    def has_permission(self):
+        # Program-wide figures span every location
+        return self.request.user.is_staff and super().has_permission()
+
+    def get_context_data(self, **kwargs):
+        context = super(LedgerAnalytics, self).get_context_data(**kwargs)
+        context["available"] = analytics_available()
+        if context["available"]:
+            # Every figure comes from the same cached snapshot of the ledger
+            snapshot = ledger_snapshot()
+            context["services"] = len(snapshot)
+            context["balances"] = sorted(snapshot.balances_by_location().items())
+            context["absence_rates"] = sorted(
+                snapshot.absence_rates_by_agency().items()
+            )
+            context["completion"] = sorted(snapshot.completion_days().items())
+        return context
+
+
+class ClassSession(PermissionRequiredMixin, LoginRequiredMixin, generic.FormView):
+    # Takes attendance for a whole class at once instead of one service at a time
+    template_name = "records/attendance/class-session.html"
+    form_class = ClassSessionForm
+    permission_required = ("records.add_service", "records.add_casenote")
+    roster_fields = ["id", "f_name", "m_name", "l_name", "dcs"]
+    # Largest id a 64-bit primary key column holds
+    max_client_id = 2**63 - 1
+
+    def get_form_kwargs(self):
+        kwargs = super(ClassSession, self).get_form_kwargs()
+        clients = Client.objects.visible_to(self.request.user).only(*self.roster_fields)
+        if self.request.method == "POST":
+            # The submitted roster is looked up with a single pk__in query. Ids that
+            # are not positive 64-bit integers cannot match and count as missing.
+            roster = set()
+            invalid = 0
+            for value in self.request.POST.getlist("roster"):
+                try:
+                    pk = int(value)
+                except ValueError:
+                    pk = None
+                if pk is None or not 0 < pk <= self.max_client_id:
+                    invalid += 1
+                else:
+                    roster.add(pk)
+            clients = list(clients.filter(pk__in=roster).order_by("l_name", "id"))
+            self.missing_clients = invalid + len(roster) - len(clients)
         else:
-            new_list = client_list
-        for index in range(1, len(field_list)):
-            new_list = new_list | client_list.filter(**{field: field_list[index]})
-        return new_list
-    return client_list
+            location = self.request.GET.get("location", "")
+            clients = clients.filter(
+                current_status=ACTIVE, primary_location=location
+            ).order_by("l_name", "id")
+        kwargs["clients"] = clients
+        return kwargs
 
+    def get_initial(self):
+        user = self.request.user
+        return {
+            "location": self.request.GET.get("location", ""),
+            "facilitator": user.get_full_name()[:25],
+        }
 
-def search_referrals_advanced(contains=False, **kwargs):
-    ref_list = Referral.objects.filter(deleted=False)
-    for key, value in kwargs.items():
-        if value != "":
-            if contains:
-                key = key + "__contains"
-            ref_list = ref_list.filter(**{key: value})
-    return ref_list.order_by("agency")
+    def form_valid(self, form):
+        if self.missing_clients:
+            form.add_error(None, "Some clients on the roster could not be found.")
+            return self.form_invalid(form)
+        user = self.request.user
+        services, _ = record_class_session(
+            form.session(),
+            form.roster(),
+            updated_by=user.get_full_name() or user.username,
+        )
+        query = urlencode(
+            {"location": form.cleaned_data["location"], "recorded": len(services)}
+        )
+        return HttpResponseRedirect(f"{reverse('records:class-session')}?{query}")
+
+    def get_context_data(self, **kwargs):
+        context = super(ClassSession, self).get_context_data(**kwargs)
+        context["recorded"] = self.request.GET.get("recorded")
+        return context
 
 
 class AdvancedSearch(PermissionRequiredMixin, LoginRequiredMixin, TemplateView):
@@ -80,71 +231,250 @@ class AdvancedSearchResults(PermissionRequiredMixin, LoginRequiredMixin, Templat
     permission_required = ("records.view_client", "records.view_referral")
     client_results = None
     referral_results = None
+    service_results = None
+    search_query = ""
+    page_size = 50
+    max_page_size = 200
 
-    def post(self, request):
-        if request.method == "POST":
-            searchbar = request.POST.get("searchbar")
-            if searchbar:
-                name_list = searchbar.split()
-                self.client_results = search_clients_advanced(
-                    True, f_name=name_list[0]
-                ) | search_clients_advanced(True, l_name=name_list[0])
-                for name in name_list[1:]:
-                    self.client_results = (
-                        self.client_results
-                        | search_clients_advanced(True, f_name=name)
-                        | search_clients_advanced(True, l_name=name)
+    def get(self, request, *args, **kwargs):
+        extra_context = self.search(request)
+        return self.render_to_response(self.get_context_data(**extra_context))
+
+    def search(self, request):
+        # Searches run from normalized GET parameters so they can be bookmarked and cached
+        extra_context = {}
+        searchbar = request.GET.get("q")
+        if searchbar:
+            self.client_results = search_clients_quick(request.user, searchbar)
+            self.search_query = urlencode({"q": " ".join(tokenize(searchbar))})
+        elif request.GET.get("search_type"):
+            form = SearchForm(request.GET)
+            if form.is_valid():
+                cleaned_data = form.cleaned_data
+                contains = request.GET.get("contains", False)
+                dcs_status = request.GET.get("dcs", False)
+                if dcs_status == "on":
+                    dcs_status = True
+                else:
+                    dcs_status = None
+                if cleaned_data["search_type"] == "Clients":
+                    self.client_results = search_clients_advanced(
+                        request.user, contains, dcs=dcs_status, **cleaned_data
                     )
-            else:
-                form = SearchForm(request.POST)
-                if form.is_valid():
-                    cleaned_data = form.cleaned_data
-                    contains = request.POST.get("contains", False)
-                    dcs_status = request.POST.get("dcs", False)
-                    if dcs_status == "on":
-                        dcs_status = True
-                    else:
-                        dcs_status = None
-                    if cleaned_data["search_type"] == "Clients":
-                        self.client_results = search_clients_advanced(
-                            contains,
-                            locations=cleaned_data["locations"],
-                            status=cleaned_data["status"],
-                            f_name=cleaned_data["f_name"],
-                            l_name=cleaned_data["l_name"],
-                            phone=cleaned_data["phone"],
-                            email=cleaned_data["email"],
-                            dcs=dcs_status,
-                        )
-                    else:
-                        self.referral_results = search_referrals_advanced(
-                            contains,
-                            full_name=cleaned_data["full_name"],
-                            agency=cleaned_data["agency"],
-                            phone=cleaned_data["ref_phone"],
-                            email=cleaned_data["ref_email"],
-                        )
-                    return self.render_to_response(
-                        self.get_context_data(
-                            phone=cleaned_data["phone"],
-                            email=cleaned_data["email"],
-                            dcs=dcs_status,
-                            ref_phone=cleaned_data["ref_phone"],
-                            ref_email=cleaned_data["ref_email"],
-                        )
+                elif cleaned_data["search_type"] == "Services":
+                    self.service_results = search_services_advanced(
+                        request.user, contains, **cleaned_data
                     )
-        return self.render_to_response(self.get_context_data())
+                else:
+                    self.referral_results = search_referrals_advanced(
+                        contains, **cleaned_data
+                    )
+                self.search_query = search_query_string(
+                    cleaned_data, contains=contains, dcs=dcs_status
+                )
+                extra_context = dict(
+                    phone=cleaned_data["phone"],
+                    email=cleaned_data["email"],
+                    dcs=dcs_status,
+                    ref_phone=cleaned_data["ref_phone"],
+                    ref_email=cleaned_data["ref_email"],
+                )
+        return extra_context
+
+    def post(self, request):
+        # Older forms (e.g. the header search bar) still POST; redirect them to the GET URL
+        searchbar = request.POST.get("searchbar")
+        if searchbar:
+            query = urlencode({"q": " ".join(tokenize(searchbar))})
+        else:
+            form = SearchForm(request.POST)
+            if not form.is_valid():
+                return self.render_to_response(self.get_context_data())
+            query = search_query_string(
+                form.cleaned_data,
+                contains=request.POST.get("contains", False),
+                dcs=request.POST.get("dcs", False),
+            )
+        return HttpResponseRedirect(
+            f"{reverse('records:advanced-search-results')}?{query}"
+        )
+
+    def paginate(self, results, row_class, *models):
+        if results is None:
+            return None
+        params = self.request.GET
+        try:
+            page_size = int(params.get("page_size", self.page_size))
+        except ValueError:
+            page_size = self.page_size
+        page_size = max(1, min(page_size, self.max_page_size))
+        return cached_keyset_page(
+            results,
+            result_keys(results),
+            page_size,
+            self.search_query,
+            self.request.user,
+            models,
+            after=params.get("after"),
+            before=params.get("before"),
+            row_class=row_class,
+        )
 
     def get_context_data(self, **kwargs):
         context = super(AdvancedSearchResults, self).get_context_data(**kwargs)
-        context["clients"] = self.client_results
-        context["referrals"] = self.referral_results
+        context["clients"] = self.paginate(self.client_results, ClientRow, Client)
+        context["referrals"] = self.paginate(
+            self.referral_results, ReferralRow, Referral
+        )
+        context["services"] = self.paginate(
+            self.service_results, ServiceRow, Service, Client
+        )
+        # The page being shown; its cache_key names the cached results table
+        context["page"] = next(
+            (
+                context[name]
+                for name in ("clients", "referrals", "services")
+                if context[name] is not None
+            ),
+            None,
+        )
+        # Base of the next/previous page links
+        context["search_query"] = self.search_query
+        page_size = self.request.GET.get("page_size")
+        if page_size:
+            context["search_query"] += "&" + urlencode({"page_size": page_size})
         for key in kwargs:
             context[key] = kwargs[key]
 
         return context
 
 
+class AdvancedSearchExport(AdvancedSearchResults):
+    # Streams every result of the search in the query string as CSV
+    http_method_names = ["get"]
+
+    def get(self, request, *args, **kwargs):
+        self.search(request)
+        if self.service_results is not None:
+            return export_services("services.csv", self.service_results)
+        if self.referral_results is not None:
+            return export_referrals("referrals.csv", self.referral_results)
+        if self.client_results is not None:
+            return export_clients("clients.csv", self.client_results)
+        return HttpResponseRedirect(reverse("records:advanced-search"))
+
+
+@login_required
+@permission_required(
+    ("records.view_client", "records.view_referral"), raise_exception=True
+)
+def typeahead(request):
+    # JSON matches for the search page's quick find box
+    prefix = request.GET.get("q", "").strip()
+    try:
+        limit = min(int(request.GET.get("limit", 8)), 20)
+    except ValueError:
+        limit = 8
+    if len(prefix) < 2 or limit < 1:
+        return JsonResponse({"clients": [], "referrals": []})
+
+    clients, referrals = search_typeahead(request.user, prefix, limit)
+    return JsonResponse(
+        {
+            "clients": [
+                {
+                    "label": f"{client['f_name']} {client['l_name']}".title()
+                    + f" ({client['primary_location']})",
+                    "url": reverse("records:detail", args=[client["id"]]),
+                }
+                for client in clients
+            ],
+            "referrals": [
+                {
+                    "label": f"{referral['agency']}--{referral['full_name']}",
+                    "url": reverse("records:ref_detail", args=[referral["id"]]),
+                }
+                for referral in referrals
+            ],
+        }
+    )
+
+
+@login_required
+@permission_required("records.view_referral", raise_exception=True)
+def referral_options(request):
+    # JSON options for referral selects rendered with ReferralSelectForm(remote=True)
+    text = request.GET.get("q", "").strip().lower()
+    try:
+        limit = min(int(request.GET.get("limit", 20)), 100)
+    except ValueError:
+        limit = 20
+    matches = [choice for choice in referral_choices() if text in choice.lower()]
+    return JsonResponse({"choices": matches[: max(limit, 0)]})
+
+
+class ImportUpload(PermissionRequiredMixin, LoginRequiredMixin, generic.FormView):
+    template_name = "records/import/import-upload.html"
+    form_class = ImportForm
+    permission_required = (
+        "records.add_client",
+        "records.add_referral",
+        "records.add_service",
+    )
+    max_errors_shown = 200
+
+    def has_permission(self):
+        # Bulk imports are for staff onboarding a location, not everyday users
+        return self.request.user.is_staff and super().has_permission()
+
+    def form_valid(self, form):
+        importer = IMPORTERS[form.cleaned_data["kind"]](
+            dry_run=form.cleaned_data["dry_run"]
+        )
+        # ImportForm has already decoded and parsed the whole file
+        report = importer.run(io.StringIO(form.cleaned_data["file"], newline=""))
+        return self.render_to_response(
+            self.get_context_data(
+                form=form,
+                report=report,
+                errors=report.errors[: self.max_errors_shown],
+            )
+        )
+
+
+class RequestStats(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
+    template_name = "records/reports/report-request-stats.html"
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get_context_data(self, **kwargs):
+        context = super(RequestStats, self).get_context_data(**kwargs)
+        # Slowest views first
+        context["views"] = sorted(
+            metrics.summary(),
+            key=lambda row: row["percentiles"]["duration"][95] or 0,
+            reverse=True,
+        )
+        context["query_budget"] = query_budget()
+        return context
+
+
+def request_metrics(request):
+    # Staff, or a scraper presenting settings.RECORDS_METRICS_TOKEN as a bearer token
+    token = getattr(settings, "RECORDS_METRICS_TOKEN", None)
+    authorization = request.headers.get("Authorization", "")
+    if not request.user.is_staff and not (
+        # Compared as bytes, since compare_digest() rejects non-ASCII strings
+        token
+        and secrets.compare_digest(authorization.encode(), f"Bearer {token}".encode())
+    ):
+        return HttpResponseForbidden()
+    return HttpResponse(
+        metrics_text(metrics.summary()), content_type="text/plain; version=0.0.4"
+    )
+
+
 class ProfileView(LoginRequiredMixin, TemplateView):
     template_name = "records/user/edit-profile.html"
 
@@ -0,0 +1,65 @@
+import datetime
+
+from django.db.models import Sum
+
+from records.models import SERVICE_CATEGORY_CHOICES, MonthlyRollup, RollupDirtyMonth
+
+CATEGORY_LABELS = dict(SERVICE_CATEGORY_CHOICES)
+
+# Rollup columns that can be summed over months, locations and categories
+ADDITIVE_TOTALS = ["services", "attended", "credits", "fees", "discounts", "payments"]
+
+
+def in_period(queryset, year=None, month=None):
+    """Filters rows by their month column; a month without a year selects it in every year"""
+    if year:
+        queryset = queryset.filter(
+            month__gte=datetime.date(year, 1, 1),
+            month__lt=datetime.date(year + 1, 1, 1),
+        )
+    if month:
+        queryset = queryset.filter(month__month=month)
+    return queryset
+
+
+def rollups_for(year=None, month=None, locations=None):
+    """
+    The rollup rows of a period as of the last refresh. Reports only read them;
+    the refresh_rollups command brings changed months up to date.
+    """
+    rollups = in_period(MonthlyRollup.objects.all(), year, month)
+    if locations is not None:
+        rollups = rollups.filter(location__in=locations)
+    return rollups
+
+
+def monthly_report(year=None, month=None, locations=None):
+    """
+    Reads a period's report from the rollup tables: totals per month and location,
+    totals per service category, the grand totals, and the months changed since
+    the last refresh, in four small queries however much ledger history the period
+    covers
+    """
+    rollups = rollups_for(year, month, locations)
+    sums = {total: Sum(total) for total in ADDITIVE_TOTALS}
+    months = rollups.filter(category=None).order_by("month", "location")
+    categories = [
+        dict(row, label=CATEGORY_LABELS[row["category"]])
+        for row in rollups.exclude(category=None)
+        .values("category")
+        .annotate(**sums)
+        .order_by("category")
+    ]
+    totals = rollups.filter(category=None).aggregate(**sums)
+    # Months of the period changed since the last refresh, shown as out of date
+    stale_months = list(
+        in_period(RollupDirtyMonth.objects.order_by("month"), year, month).values_list(
+            "month", flat=True
+        )
+    )
+    return {
+        "months": months,
+        "categories": categories,
+        "totals": totals,
+        "stale_months": stale_months,
+    }
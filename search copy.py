@@ -0,0 +1,826 @@
+import datetime
+import json
+import threading
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict, defaultdict
+from functools import reduce
+from operator import and_, or_
+from urllib.parse import urlencode
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Case, Expression, F, IntegerField, Q, Value, When
+from django.db.models.functions import Abs, Length
+
+from records.models import (
+    CURRENT_STATUS_CHOICES,
+    Client,
+    Referral,
+    Service,
+    allowed_locations,
+    client_display_name,
+    normalize_email,
+    normalize_phone,
+    search_version,
+    soundex,
+)
+from records.fulltext import search_fulltext
+from records.name_index import NAME_INDEX
+
+# Name fields the quick search bar matches tokens against
+CLIENT_NAME_FIELDS = ("f_name", "m_name", "l_name")
+
+# Keyset orderings for paginated results. The trailing id makes every key unique.
+CLIENT_KEYS = ["l_name", "id"]
+REFERRAL_KEYS = ["agency", "id"]
+SERVICE_KEYS = ["-date", "-id"]
+# Results matched through the full-text index put the best ranked first, and
+# "sounds like" client results put the closest spellings first
+FULLTEXT_RANK_KEY = "fulltext_rank"
+PHONETIC_DISTANCE_KEY = "match_distance"
+
+# Name fields a "sounds like" search matches through their indexed Soundex keys
+PHONETIC_FIELDS = {"f_name": "f_name_soundex", "l_name": "l_name_soundex"}
+
+# Phonetic matches further than this from the searched spelling are ranked last
+MAX_NAME_DISTANCE = 3
+
+# Most phonetic candidates re-ranked per search, closest spellings first; the rest
+# are ranked last
+PHONETIC_CANDIDATES = 2000
+
+# Leading letters a candidate shares with the searched spelling to be tried early
+PHONETIC_PREFIX = 2
+
+
+class Filter:
+    """Maps one SearchForm field onto a lookup against a model field"""
+
+    def __init__(self, form_field, model_field=None):
+        self.form_field = form_field
+        self.model_field = model_field or form_field
+
+    def compile(self, data, contains):
+        """Returns a Q for the submitted value, or None when the field was left blank"""
+        raise NotImplementedError
+
+
+class TextFilter(Filter):
+    """Free text compared with an indexable lookup, or icontains in contains mode"""
+
+    def __init__(self, form_field, lookup="iexact", model_field=None):
+        super().__init__(form_field, model_field)
+        self.lookup = lookup
+
+    def compile(self, data, contains):
+        value = data.get(self.form_field)
+        if value in ("", None):
+            return None
+        lookup = "icontains" if contains else self.lookup
+        return Q(**{f"{self.model_field}__{lookup}": value})
+
+
+class AnyTextFilter(Filter):
+    """Free text that may match any one of several model fields, e.g. the cause numbers"""
+
+    def __init__(self, form_field, model_fields, lookup="iexact"):
+        super().__init__(form_field)
+        self.model_fields = model_fields
+        self.lookup = lookup
+
+    def compile(self, data, contains):
+        value = data.get(self.form_field)
+        if value in ("", None):
+            return None
+        lookup = "icontains" if contains else self.lookup
+        return reduce(
+            or_, (Q(**{f"{field}__{lookup}": value}) for field in self.model_fields)
+        )
+
+
+class NormalizedFilter(Filter):
+    """
+    Free text normalized the same way the model fills its lookup column, then
+    prefix matched (which includes exact matches) against that indexed column
+    """
+
+    def __init__(self, form_field, normalize, model_field):
+        super().__init__(form_field, model_field)
+        self.normalize = normalize
+
+    def compile(self, data, contains):
+        value = data.get(self.form_field)
+        if value in ("", None):
+            return None
+        value = self.normalize(value)
+        if not value:
+            # e.g. a phone search with no digits in it can never match
+            return Q(pk__in=[])
+        lookup = "contains" if contains else "startswith"
+        return Q(**{f"{self.model_field}__{lookup}": value})
+
+
+class ChoiceFilter(Filter):
+    """A multi-select compiled to a single __in lookup"""
+
+    def compile(self, data, contains):
+        values = data.get(self.form_field)
+        if not values:
+            return None
+        return Q(**{f"{self.model_field}__in": list(values)})
+
+
+class FlagFilter(Filter):
+    """A checkbox that only narrows the search when it is ticked"""
+
+    def compile(self, data, contains):
+        if not data.get(self.form_field):
+            return None
+        return Q(**{self.model_field: True})
+
+
+class DateRangeFilter(Filter):
+    """A pair of <field>_from / <field>_to dates compiled to __gte / __lte"""
+
+    def compile(self, data, contains):
+        bounds = {}
+        if data.get(f"{self.form_field}_from"):
+            bounds[f"{self.model_field}__gte"] = data[f"{self.form_field}_from"]
+        if data.get(f"{self.form_field}_to"):
+            bounds[f"{self.model_field}__lte"] = data[f"{self.form_field}_to"]
+        return Q(**bounds) if bounds else None
+
+
+# SearchForm fields mapped onto each model. Names and agencies use prefix
+# matches the Upper() indexes on the models can serve; phones and emails are
+# matched against their normalized, indexed columns.
+CLIENT_FILTERS = [
+    TextFilter("f_name", "istartswith"),
+    TextFilter("l_name", "istartswith"),
+    NormalizedFilter("phone", normalize_phone, "phone_digits"),
+    NormalizedFilter("email", normalize_email, "email_lower"),
+    AnyTextFilter("cause", ("cause", "cause2", "cause3")),
+    FlagFilter("dcs"),
+    ChoiceFilter("locations", "primary_location"),
+    ChoiceFilter("status", "current_status"),
+    DateRangeFilter("dob"),
+    DateRangeFilter("date_enroll"),
+    DateRangeFilter("date_discharge"),
+]
+
+REFERRAL_FILTERS = [
+    TextFilter("full_name", "istartswith"),
+    TextFilter("agency", "istartswith"),
+    NormalizedFilter("ref_phone", normalize_phone, "phone_digits"),
+    NormalizedFilter("ref_email", normalize_email, "email_lower"),
+]
+
+# In contains mode these SearchForm fields are matched through the full-text
+# index instead of icontains scans, each against the columns listed
+CLIENT_FULLTEXT = {
+    "f_name": ("f_name",),
+    "l_name": ("l_name",),
+    "phone": ("phone_digits",),
+    "email": ("email",),
+    "cause": ("cause", "cause2", "cause3"),
+}
+
+REFERRAL_FULLTEXT = {
+    "full_name": ("full_name",),
+    "agency": ("agency",),
+    "ref_email": ("email",),
+}
+
+# Full-text terms normalized like the NormalizedFilter they stand in for
+FULLTEXT_NORMALIZE = {
+    "phone": normalize_phone,
+    "email": normalize_email,
+    "ref_email": normalize_email,
+}
+
+SERVICE_FILTERS = [
+    ChoiceFilter("service_desc", "desc"),
+    ChoiceFilter("service_category", "category"),
+    DateRangeFilter("service_date", "date"),
+]
+
+
+def compile_filters(filters, data, contains=False, skip=()):
+    """
+    ANDs together the lookups of every filter that has a value into one Q, leaving
+    out filters on the form fields in skip
+    """
+    return reduce(
+        and_,
+        (
+            q
+            for q in (
+                f.compile(data, contains) for f in filters if f.form_field not in skip
+            )
+            if q is not None
+        ),
+        Q(),
+    )
+
+
+def compile_fulltext(model, columns, data):
+    """
+    Matches the submitted text fields listed in columns through the full-text
+    backend. Returns a Q on the hits, an expression ranking them and the form fields
+    it covered, or (None, None, ()) when it can match none of them, so the caller
+    keeps icontains for every field it did not cover.
+    """
+    terms = {}
+    for field, field_columns in columns.items():
+        value = data.get(field)
+        if value in ("", None):
+            continue
+        normalize = FULLTEXT_NORMALIZE.get(field)
+        terms[field] = (field_columns, normalize(value) if normalize else value)
+    if not terms:
+        return None, None, ()
+    query, rank, rest = search_fulltext(model, list(terms.values()))
+    if query is None:
+        return None, None, ()
+    return (
+        query,
+        rank,
+        tuple(field for field, term in terms.items() if term not in rest),
+    )
+
+
+def tokenize(text):
+    """Splits search input into unique tokens, keeping their original order"""
+    return list(dict.fromkeys(text.split())) if text else []
+
+
+def compile_name_query(tokens, fields=CLIENT_NAME_FIELDS, lookup="icontains"):
+    """
+    Builds one flat Q where every token must appear in at least one of the fields:
+    (f_name LIKE t1 OR l_name LIKE t1) AND (f_name LIKE t2 OR l_name LIKE t2) ...
+    """
+    return reduce(
+        and_,
+        (
+            reduce(or_, (Q(**{f"{field}__{lookup}": token}) for field in fields))
+            for token in tokens
+        ),
+        Q(),
+    )
+
+
+def edit_distance(a, b, bound):
+    """
+    Levenshtein distance between a and b, giving up with bound + 1 as soon as the
+    distance is certain to exceed bound
+    """
+    if abs(len(a) - len(b)) > bound:
+        return bound + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(
+                min(
+                    previous[j] + 1,
+                    current[j - 1] + 1,
+                    previous[j - 1] + (char_a != char_b),
+                )
+            )
+        if min(current) > bound:
+            return bound + 1
+        previous = current
+    return min(previous[-1], bound + 1)
+
+
+def mismatch_count(lookups):
+    """How many of the lookups a row fails, as a SQL expression"""
+    return sum(
+        (Case(When(lookup, then=Value(0)), default=Value(1)) for lookup in lookups),
+        Value(0),
+    )
+
+
+def phonetic_candidates(clients, names, keys):
+    """
+    The clients worth scoring against the searched names, closest first, capped at
+    PHONETIC_CANDIDATES. A name whose length differs from the searched one by more
+    than MAX_NAME_DISTANCE is that many edits away at least, so those clients are
+    left out. The rest are tried exact matches first, then those sharing the
+    searched names' leading letters, then by how close their lengths are, so the
+    best matches are scored however far into the keys' order they sort.
+    """
+    lengths = {f"{field}_length": Length(field) for field in names}
+    clients = clients.alias(**lengths).filter(
+        **{
+            f"{field}_length__range": (
+                len(name) - MAX_NAME_DISTANCE,
+                len(name) + MAX_NAME_DISTANCE,
+            )
+            for field, name in names.items()
+        }
+    )
+    return clients.alias(
+        phonetic_exact=mismatch_count(
+            Q(**{f"{field}__iexact": name}) for field, name in names.items()
+        ),
+        phonetic_prefix=mismatch_count(
+            Q(**{f"{field}__istartswith": name[:PHONETIC_PREFIX]})
+            for field, name in names.items()
+        ),
+        phonetic_length_gap=sum(
+            (Abs(F(f"{field}_length") - len(name)) for field, name in names.items()),
+            Value(0),
+        ),
+    ).order_by("phonetic_exact", "phonetic_prefix", "phonetic_length_gap", *keys)[
+        :PHONETIC_CANDIDATES
+    ]
+
+
+class PhoneticDistance(Expression):
+    """
+    The match_distance of rank_phonetic(). Candidates are scored the first time a
+    query using it is compiled, so a cached page, whose rows are loaded without it,
+    never scores them. The scores are kept, so the count, page and cursor queries of
+    one search score them once.
+    """
+
+    output_field = IntegerField()
+
+    def __init__(self, clients, names, keys):
+        super().__init__()
+        self.clients = clients
+        self.names = names
+        self.keys = keys
+        # Shared by the copies Django makes of the expression as queries are cloned
+        self.scores = {}
+
+    def distance_case(self):
+        if "case" not in self.scores:
+            fields = list(self.names)
+            by_distance = defaultdict(list)
+            candidates = phonetic_candidates(self.clients, self.names, self.keys)
+            for pk, *values in candidates.values_list("id", *fields):
+                distance = sum(
+                    edit_distance(
+                        self.names[field].lower(), value.lower(), MAX_NAME_DISTANCE
+                    )
+                    for field, value in zip(fields, values)
+                )
+                if distance <= MAX_NAME_DISTANCE:
+                    by_distance[distance].append(pk)
+            self.scores["case"] = Case(
+                *(
+                    When(pk__in=ids, then=Value(distance))
+                    for distance, ids in sorted(by_distance.items())
+                ),
+                default=Value(MAX_NAME_DISTANCE + 1),
+                output_field=IntegerField(),
+            )
+        return self.scores["case"]
+
+    def as_sql(self, compiler, connection):
+        return compiler.compile(self.distance_case().resolve_expression(compiler.query))
+
+
+def rank_phonetic(clients, names, keys=CLIENT_KEYS):
+    """
+    Annotates match_distance, the total edit distance of each client's names from
+    the searched spellings (capped at MAX_NAME_DISTANCE + 1). Only the names of the
+    phonetic candidates, the first in the keys' order, are scored in Python, never
+    the whole table, and only once the results are fetched.
+    """
+    return clients.annotate(
+        **{PHONETIC_DISTANCE_KEY: PhoneticDistance(clients, names, keys)}
+    )
+
+
+def result_keys(results):
+    """
+    The keyset keys of a search's results. Every search orders its results by the
+    keys they are paginated with, so they are read back from that ordering.
+    """
+    return list(results.query.order_by)
+
+
+# Client and service searches only return clients from locations the user may see
+def search_clients_quick(user, text):
+    tokens = tokenize(text)
+    if not tokens:
+        return Client.objects.none()
+    clients = Client.objects.visible_to(user)
+    keys = CLIENT_KEYS
+    # Tokens too short for the full-text index are matched with icontains
+    query, rank, rest = search_fulltext(
+        Client, [(CLIENT_NAME_FIELDS, token) for token in tokens]
+    )
+    if query is not None:
+        clients = clients.filter(query).annotate(**{FULLTEXT_RANK_KEY: rank})
+        keys = [FULLTEXT_RANK_KEY, *keys]
+    clients = clients.filter(compile_name_query([token for _, token in rest]))
+    return clients.order_by(*keys)
+
+
+def search_clients_advanced(user, contains=False, **data):
+    clients = Client.objects.visible_to(user)
+    keys = CLIENT_KEYS
+    skip = ()
+    names = {}
+    if data.get("name_match") == "phonetic":
+        names = {field: data[field] for field in PHONETIC_FIELDS if data.get(field)}
+        clients = clients.filter(
+            **{PHONETIC_FIELDS[field]: soundex(name) for field, name in names.items()}
+        )
+        skip = tuple(names)
+    if contains:
+        columns = {
+            field: column
+            for field, column in CLIENT_FULLTEXT.items()
+            if field not in skip
+        }
+        query, rank, covered = compile_fulltext(Client, columns, data)
+        if query is not None:
+            clients = clients.filter(query).annotate(**{FULLTEXT_RANK_KEY: rank})
+            keys = [FULLTEXT_RANK_KEY, *keys]
+            skip += covered
+    clients = clients.filter(compile_filters(CLIENT_FILTERS, data, contains, skip))
+    if names:
+        clients = rank_phonetic(clients, names, keys)
+        keys = [PHONETIC_DISTANCE_KEY, *keys]
+    return clients.order_by(*keys)
+
+
+def search_referrals_advanced(contains=False, **data):
+    referrals = Referral.objects.all()
+    keys = REFERRAL_KEYS
+    skip = ()
+    if contains:
+        query, rank, skip = compile_fulltext(Referral, REFERRAL_FULLTEXT, data)
+        if query is not None:
+            referrals = referrals.filter(query).annotate(**{FULLTEXT_RANK_KEY: rank})
+            keys = [FULLTEXT_RANK_KEY, *keys]
+    return referrals.filter(
+        compile_filters(REFERRAL_FILTERS, data, contains, skip)
+    ).order_by(*keys)
+
+
+def search_services_advanced(user, contains=False, **data):
+    services = Service.objects.filter(
+        compile_filters(SERVICE_FILTERS, data, contains),
+        client__deleted=False,
+    )
+    locations = allowed_locations(user)
+    if locations is not None:
+        services = services.filter(client__primary_location__in=locations)
+    return services.select_related("client").order_by(*SERVICE_KEYS)
+
+
+STATUS_LABELS = dict(CURRENT_STATUS_CHOICES)
+
+
+class ClientRow:
+    """A client results row: only the columns the table shows, display strings precomputed"""
+
+    __slots__ = ("id", "name", "primary_location", "status", "email", "phone", "dcs")
+    fields = [
+        "id",
+        "f_name",
+        "m_name",
+        "l_name",
+        "primary_location",
+        "current_status",
+        "email",
+        "phone",
+        "dcs",
+    ]
+
+    def __init__(self, values):
+        self.id = values["id"]
+        self.name = client_display_name(
+            values["f_name"], values["m_name"], values["l_name"]
+        )
+        self.primary_location = values["primary_location"]
+        self.status = STATUS_LABELS.get(
+            values["current_status"], values["current_status"]
+        )
+        self.email = values["email"]
+        self.phone = values["phone"]
+        self.dcs = values["dcs"]
+
+    def __str__(self):
+        return self.name
+
+
+class ReferralRow:
+    __slots__ = ("id", "agency", "full_name", "email", "phone")
+    fields = list(__slots__)
+
+    def __init__(self, values):
+        for field in self.__slots__:
+            setattr(self, field, values[field])
+
+
+class ServiceRow:
+    __slots__ = (
+        "id",
+        "date",
+        "client_id",
+        "client_name",
+        "desc",
+        "fee",
+        "payment",
+        "credit",
+    )
+    fields = [
+        "id",
+        "date",
+        "client_id",
+        "client__f_name",
+        "client__m_name",
+        "client__l_name",
+        "desc",
+        "fee",
+        "payment",
+        "credit",
+    ]
+
+    def __init__(self, values):
+        self.id = values["id"]
+        self.date = values["date"]
+        self.client_id = values["client_id"]
+        self.client_name = client_display_name(
+            values["client__f_name"], values["client__m_name"], values["client__l_name"]
+        )
+        self.desc = values["desc"]
+        self.fee = values["fee"]
+        self.payment = values["payment"]
+        self.credit = values["credit"]
+
+
+class KeysetPage:
+    """
+    One page of search results with opaque cursors to the neighbouring pages. rows
+    may be a callable, which is only called (once) when the rows are first used.
+    """
+
+    def __init__(self, rows, next_cursor=None, previous_cursor=None, cache_key=None):
+        self._rows = rows
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        # Identifies this page's contents, for caching what is rendered from it
+        self.cache_key = cache_key
+
+    @property
+    def rows(self):
+        if callable(self._rows):
+            self._rows = self._rows()
+        return self._rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __bool__(self):
+        return bool(self.rows)
+
+
+def encode_cursor(values):
+    return urlsafe_b64encode(
+        json.dumps(values, cls=DjangoJSONEncoder).encode()
+    ).decode()
+
+
+def decode_cursor(cursor):
+    """Returns the key values stored in a cursor, or None if it is missing or malformed"""
+    if not cursor:
+        return None
+    try:
+        values = json.loads(urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        return None
+    return values if isinstance(values, list) else None
+
+
+def clean_cursor(queryset, keys, values):
+    """
+    The decoded cursor values converted to the types of the keys they stand for, or
+    None when they do not fit the keys, so a tampered cursor shows the first page
+    """
+    if values is None or len(values) != len(keys):
+        return None
+    cleaned = []
+    for key, value in zip(keys, values):
+        name = key.lstrip("-")
+        annotation = queryset.query.annotations.get(name)
+        if annotation is not None:
+            field = annotation.output_field
+        else:
+            field = queryset.model._meta.get_field(name)
+        try:
+            value = field.to_python(value)
+        except (ValidationError, TypeError, ValueError):
+            return None
+        # Seeking compares with < and >, which never match NULL
+        if value is None:
+            return None
+        cleaned.append(value)
+    return cleaned
+
+
+def reverse_key(key):
+    return key[1:] if key.startswith("-") else f"-{key}"
+
+
+def seek_q(keys, values):
+    """
+    Matches rows strictly after the given key values in the keys' ordering, e.g. for
+    ["l_name", "id"]: l_name > v1 OR (l_name = v1 AND id > v2)
+    """
+    clauses = []
+    for index, key in enumerate(keys):
+        equal = {k.lstrip("-"): v for k, v in zip(keys[:index], values)}
+        lookup = "lt" if key.startswith("-") else "gt"
+        clauses.append(Q(**equal, **{f"{key.lstrip('-')}__{lookup}": values[index]}))
+    return reduce(or_, clauses)
+
+
+def paginate_keyset(queryset, keys, page_size, after=None, before=None, row_class=None):
+    """
+    Returns a KeysetPage of the queryset ordered by keys. Pages seek past the cursor
+    row with an indexed WHERE clause instead of an OFFSET, so deep pages cost the
+    same as the first one. With a row_class, only its fields are fetched, and the
+    page holds row_class objects instead of model instances.
+    """
+    after = clean_cursor(queryset, keys, decode_cursor(after))
+    before = clean_cursor(queryset, keys, decode_cursor(before))
+    cursor = before or after
+
+    order = [reverse_key(key) for key in keys] if before else keys
+    rows = queryset.order_by(*order)
+    if cursor:
+        rows = rows.filter(seek_q(order, cursor))
+    key_fields = [key.lstrip("-") for key in keys]
+    if row_class is not None:
+        rows = rows.values(*dict.fromkeys(row_class.fields + key_fields))
+    rows = list(rows[: page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if before:
+        rows.reverse()
+    if not rows:
+        return KeysetPage(rows)
+
+    def row_cursor(row):
+        if row_class is not None:
+            return encode_cursor([row[key] for key in key_fields])
+        return encode_cursor([getattr(row, key) for key in key_fields])
+
+    more_after = has_more if not before else True
+    more_before = has_more if before else bool(after)
+    return KeysetPage(
+        rows if row_class is None else [row_class(values) for values in rows],
+        next_cursor=row_cursor(rows[-1]) if more_after else None,
+        previous_cursor=row_cursor(rows[0]) if more_before else None,
+    )
+
+
+def search_typeahead(user, text, limit):
+    """
+    Top matches for a name prefix, for the typeahead. Every token must start one of
+    the name fields. Served from the in-memory NAME_INDEX once it is built, and
+    otherwise from the database, where the Upper() name indexes serve the prefix
+    lookups and only the columns the dropdown shows are fetched.
+    """
+    tokens = tokenize(text)
+    if not tokens:
+        return [], []
+    keys = [token.lower() for token in tokens]
+    clients = NAME_INDEX.lookup_clients(keys, allowed_locations(user), limit)
+    referrals = NAME_INDEX.lookup_referrals(keys, limit)
+    if clients is not None and referrals is not None:
+        return clients, referrals
+
+    # The in-memory index is still loading; answer from the database meanwhile
+    clients = (
+        Client.objects.visible_to(user)
+        .filter(compile_name_query(tokens, ("f_name", "l_name"), "istartswith"))
+        .order_by(*CLIENT_KEYS)
+        .values("id", "f_name", "l_name", "primary_location")[:limit]
+    )
+    referrals = (
+        Referral.objects.filter(
+            compile_name_query(tokens, ("full_name", "agency"), "istartswith")
+        )
+        .order_by(*REFERRAL_KEYS)
+        .values("id", "full_name", "agency")[:limit]
+    )
+    return list(clients), list(referrals)
+
+
+def search_query_string(cleaned_data, **flags):
+    """
+    Canonical GET query for a search, so equivalent searches share one URL and one
+    cache entry: blank fields are dropped and keys and multi-select values sorted
+    """
+    params = []
+    for key in sorted(cleaned_data):
+        value = cleaned_data[key]
+        if value in ("", None) or value == []:
+            continue
+        if isinstance(value, (list, tuple)):
+            params.extend((key, str(item)) for item in sorted(value, key=str))
+        elif isinstance(value, datetime.date):
+            params.append((key, value.isoformat()))
+        else:
+            params.append((key, str(value)))
+    params.extend((flag, "on") for flag in sorted(flags) if flags[flag])
+    return urlencode(sorted(params))
+
+
+class ResultCache:
+    """A thread-safe, bounded LRU mapping of search keys to pages of result ids"""
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+RESULT_CACHE = ResultCache()
+
+
+def permission_scope(user):
+    locations = allowed_locations(user)
+    return "all" if locations is None else ",".join(sorted(locations))
+
+
+def cached_keyset_page(
+    results,
+    keys,
+    page_size,
+    query,
+    user,
+    models,
+    after=None,
+    before=None,
+    row_class=None,
+):
+    """
+    paginate_keyset() backed by RESULT_CACHE. Only the page's ids and cursors are
+    cached; the key covers the normalized query, the user's location scope and the
+    search versions of every model the results depend on, so entries go stale the
+    moment one of those models is saved or deleted. On a hit the rows are loaded
+    lazily, so a page whose rendering is cached too never queries for them.
+    """
+    key = (
+        query,
+        permission_scope(user),
+        tuple(search_version(model) for model in models),
+        page_size,
+        after,
+        before,
+    )
+    cached = RESULT_CACHE.get(key)
+    if cached is None:
+        page = paginate_keyset(
+            results, keys, page_size, after=after, before=before, row_class=row_class
+        )
+        RESULT_CACHE.set(
+            key, ([row.id for row in page], page.next_cursor, page.previous_cursor)
+        )
+        page.cache_key = repr(key)
+        return page
+
+    ids, next_cursor, previous_cursor = cached
+
+    def load_rows():
+        if row_class is None:
+            rows = results.in_bulk(ids)
+        else:
+            # Unordered and limited to the row's fields, so ranking annotations
+            # (e.g. phonetic scores) the rows do not show are never computed
+            rows = {
+                values["id"]: row_class(values)
+                for values in results.filter(pk__in=ids)
+                .order_by()
+                .values(*row_class.fields)
+            }
+        return [rows[pk] for pk in ids if pk in rows]
+
+    return KeysetPage(load_rows, next_cursor, previous_cursor, cache_key=repr(key))
@@ -0,0 +1,51 @@
+// Selects with the "remote-select" class load their options from data-url as the
+// user types in a filter box added above them, instead of rendering every option
+document.querySelectorAll("select.remote-select").forEach(function (select) {
+    var filter = document.createElement("input");
+    filter.type = "search";
+    filter.className = "form-control mb-1";
+    filter.placeholder = "Type to search";
+    select.parentNode.insertBefore(filter, select);
+
+    var timer = null;
+    var request = null;
+    filter.addEventListener("input", function () {
+        clearTimeout(timer);
+        timer = setTimeout(fetch_options, 200);
+    });
+
+    function fetch_options() {
+        if (request) {
+            request.abort();
+        }
+        request = new AbortController();
+        fetch(select.dataset.url + "?" + new URLSearchParams({q: filter.value.trim()}), {
+            signal: request.signal,
+            headers: {"Accept": "application/json"},
+        })
+            .then(function (response) { return response.json(); })
+            .then(show_options)
+            .catch(function (error) {
+                if (error.name != "AbortError") {
+                    throw error;
+                }
+            });
+    }
+
+    function show_options(data) {
+        // Keep the current selection even when it no longer matches the filter
+        var selected = select.value;
+        var choices = [""].concat(data.choices);
+        if (selected && choices.indexOf(selected) == -1) {
+            choices.splice(1, 0, selected);
+        }
+        select.innerHTML = "";
+        choices.forEach(function (choice) {
+            var option = document.createElement("option");
+            option.value = choice;
+            option.textContent = choice;
+            option.selected = choice == selected;
+            select.appendChild(option);
+        });
+    }
+});
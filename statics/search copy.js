@@ -1,13 +1,60 @@
 var search_type = document.getElementById("id_search_type");
+var fieldsets = ['clients', 'referrals', 'services'];
 
 search_type.addEventListener("change", change_display);
 
 function change_display() {
-    if (search_type.value == 'Clients') {
-        document.getElementById('clients').style.display="block";
-        document.getElementById('referrals').style.display="none";
-    } else {
-        document.getElementById('referrals').style.display="block";
-        document.getElementById('clients').style.display="none";
+    // Show only the fieldset matching the selected search type
+    fieldsets.forEach(function (fieldset) {
+        var display = search_type.value.toLowerCase() == fieldset ? "block" : "none";
+        document.getElementById(fieldset).style.display=display;
+    });
+}
+
+// Quick find: query the typeahead endpoint once typing pauses, cancelling any
+// request still in flight so only the latest prefix's results are shown
+var typeahead = document.getElementById("typeahead");
+var typeahead_results = document.getElementById("typeahead-results");
+var typeahead_timer = null;
+var typeahead_request = null;
+
+if (typeahead) {
+    typeahead.addEventListener("input", function () {
+        clearTimeout(typeahead_timer);
+        typeahead_timer = setTimeout(fetch_typeahead, 200);
+    });
+}
+
+function fetch_typeahead() {
+    if (typeahead_request) {
+        typeahead_request.abort();
     }
+    var prefix = typeahead.value.trim();
+    if (prefix.length < 2) {
+        typeahead_results.innerHTML = "";
+        return;
+    }
+    typeahead_request = new AbortController();
+    fetch(typeahead.dataset.url + "?" + new URLSearchParams({q: prefix}), {
+        signal: typeahead_request.signal,
+        headers: {"Accept": "application/json"},
+    })
+        .then(function (response) { return response.json(); })
+        .then(show_typeahead)
+        .catch(function (error) {
+            if (error.name != "AbortError") {
+                throw error;
+            }
+        });
+}
+
+function show_typeahead(data) {
+    typeahead_results.innerHTML = "";
+    data.clients.concat(data.referrals).forEach(function (match) {
+        var item = document.createElement("a");
+        item.className = "list-group-item list-group-item-action";
+        item.href = match.url;
+        item.textContent = match.label;
+        typeahead_results.appendChild(item);
+    });
 }
\ No newline at end of file
@@ -0,0 +1,207 @@
+import datetime
+import io
+import os
+import subprocess
+import sys
+import tempfile
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from records import search
+from records.forms import RefMultiClientForm
+from records.fulltext import match_expression
+from records.models import (
+    Client,
+    ClientLedgerSummary,
+    Referral,
+    Service,
+    referral_choices,
+)
+from records.search import (
+    CLIENT_NAME_FIELDS,
+    compile_name_query,
+    search_clients_advanced,
+    search_clients_quick,
+)
+
+
+def nesting_depth(sql):
+    """The deepest parenthesis nesting in a SQL string"""
+    depth = deepest = 0
+    for char in sql:
+        if char == "(":
+            depth += 1
+            deepest = max(deepest, depth)
+        elif char == ")":
+            depth -= 1
+    return deepest
+
+
+class CompileNameQueryTests(SimpleTestCase):
+    def sql(self, tokens):
+        return str(Client.objects.filter(compile_name_query(tokens)).query)
+
+    def test_sql_stays_flat_as_tokens_are_added(self):
+        one = self.sql(["ann"])
+        eight = self.sql(["ann", "lee", "jo", "kim", "al", "ray", "sue", "max"])
+        self.assertEqual(nesting_depth(eight), nesting_depth(one))
+        self.assertEqual(eight.count("SELECT"), 1)
+        self.assertEqual(eight.count("JOIN"), one.count("JOIN"))
+
+    def test_every_token_is_matched_against_each_name_field(self):
+        sql = self.sql(["ann", "lee", "jo"])
+        self.assertEqual(sql.count("LIKE"), 3 * len(CLIENT_NAME_FIELDS))
+
+
+class FullTextSyncTests(TestCase):
+    def test_index_receivers_connect_without_importing_search(self):
+        # A fresh process that only sets Django up, as a management command does
+        script = (
+            "import sys, django; django.setup(); "
+            "print('records.fulltext' in sys.modules, "
+            "'records.name_index' in sys.modules)"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", script],
+            env={**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)},
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        self.assertEqual(result.stdout.split(), ["True", "True"])
+
+    def test_saved_client_is_found_by_fulltext_query(self):
+        client = Client(f_name="Johnathan", l_name="Smithers")
+        client.save()
+        matches = Client.objects.filter(
+            fulltext__match=match_expression([(("l_name",), "ithe")])
+        )
+        self.assertEqual(list(matches), [client])
+
+
+class ImportCommandTests(TestCase):
+    def test_imported_clients_are_found_by_search(self):
+        with tempfile.NamedTemporaryFile(
+            "w", suffix=".csv", delete=False, encoding="utf-8"
+        ) as file:
+            file.write("f_name,l_name\nJohnathan,Smithers\n")
+        self.addCleanup(os.remove, file.name)
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("import_csv", "clients", file.name, stdout=io.StringIO())
+
+        user = User.objects.create_superuser("staff", "staff@example.com", "password")
+        client = Client.objects.get(l_name="Smithers")
+        self.assertEqual(list(search_clients_quick(user, "smith")), [client])
+        self.assertEqual(
+            list(search_clients_advanced(user, contains=True, l_name="smi")), [client]
+        )
+
+
+@override_settings(RECORDS_METRICS_TOKEN="metrics-token")
+class RequestMetricsTests(TestCase):
+    def get(self, authorization):
+        return self.client.get(
+            reverse("records:metrics"), HTTP_AUTHORIZATION=authorization
+        )
+
+    def test_bearer_token_is_accepted(self):
+        self.assertEqual(self.get("Bearer metrics-token").status_code, 200)
+
+    def test_wrong_or_non_ascii_token_is_forbidden(self):
+        self.assertEqual(self.get("Bearer wrong").status_code, 403)
+        self.assertEqual(self.get("Bearer é").status_code, 403)
+
+
+class RefMultiClientFormTests(TestCase):
+    def test_selected_clients_are_checked_in_one_query(self):
+        ids = [
+            str(Client.objects.create(f_name="Ann", l_name=name).pk) for name in "ABC"
+        ]
+        form = RefMultiClientForm({"clients": ids})
+        with self.assertNumQueries(1):
+            self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data["clients"], ids)
+
+    def test_unknown_or_malformed_ids_are_rejected(self):
+        client = Client.objects.create(f_name="Ann", l_name="Lee")
+        for ids in ([str(client.pk), "0"], ["x"], [str(2**64)]):
+            self.assertFalse(RefMultiClientForm({"clients": ids}).is_valid())
+
+
+class PhoneticRankTests(TestCase):
+    def test_best_match_is_scored_beyond_the_candidate_cap(self):
+        # Every Schmidt sorts before Smith and sounds like it, but is further away
+        for _ in range(5):
+            Client.objects.create(f_name="Ann", l_name="Schmidt")
+        Client.objects.create(f_name="Ann", l_name="Smith")
+        user = User.objects.create_superuser("staff", "staff@example.com", "password")
+        with mock.patch("records.search.PHONETIC_CANDIDATES", 3):
+            results = search_clients_advanced(
+                user, l_name="Smith", name_match="phonetic"
+            )
+            names = list(results.values_list("l_name", "match_distance"))
+        self.assertEqual(names[0], ("Smith", 0))
+        self.assertEqual(len(names), 6)
+
+    def test_candidates_are_scored_once_per_search(self):
+        Client.objects.create(f_name="Ann", l_name="Smith")
+        user = User.objects.create_superuser("staff", "staff@example.com", "password")
+        results = search_clients_advanced(user, l_name="Smith", name_match="phonetic")
+        with mock.patch(
+            "records.search.edit_distance", wraps=search.edit_distance
+        ) as edit_distance:
+            results.count()
+            list(results)
+            list(results.filter(match_distance__lte=1))
+        self.assertEqual(edit_distance.call_count, 1)
+
+
+class ReferralChoicesTests(TestCase):
+    def test_choices_follow_committed_referrals(self):
+        before = referral_choices()
+        with self.captureOnCommitCallbacks(execute=True):
+            referral = Referral.objects.create(agency="Court--East", full_name="Lee")
+            # Not committed yet, so the cached list is still the current one
+            self.assertEqual(referral_choices(), before)
+        self.assertIn("Court--East--Lee", referral_choices())
+        with self.captureOnCommitCallbacks(execute=True):
+            referral.delete()
+        self.assertNotIn("Court--East--Lee", referral_choices())
+
+
+class LedgerSummaryTests(TestCase):
+    def test_summary_is_refreshed_once_per_commit(self):
+        client = Client.objects.create(f_name="Ann", l_name="Lee")
+        refresh = ClientLedgerSummary.objects.refresh
+        with mock.patch.object(
+            ClientLedgerSummary.objects, "refresh", wraps=refresh
+        ) as spy:
+            with self.captureOnCommitCallbacks(execute=True):
+                for day in range(1, 4):
+                    Service.objects.create(
+                        client=client,
+                        date=datetime.date(2024, 1, day),
+                        desc="Payment - No Session Attended",
+                        payment=10,
+                    )
+        spy.assert_called_once_with([client.pk])
+        self.assertEqual(ClientLedgerSummary.objects.get(client=client).payments, 30)
+
+    def test_ledger_totals_have_two_decimal_places(self):
+        client = Client.objects.create(f_name="Ann", l_name="Lee")
+        Service.objects.create(
+            client=client, date=datetime.date(2024, 1, 1), desc="Fee", fee=25
+        )
+        Service.objects.create(
+            client=client, date=datetime.date(2024, 1, 2), desc="Payment", payment=10
+        )
+        totals = Client.objects.with_ledger_totals().get(pk=client.pk)
+        # Compared as strings, since Decimal("-15") == Decimal("-15.00")
+        self.assertEqual(str(totals.ledger_fees), "25.00")
+        self.assertEqual(str(totals.ledger_payments), "10.00")
+        self.assertEqual(str(totals.ledger_discounts), "0.00")
+        self.assertEqual(str(totals.ledger_balance), "-15.00")
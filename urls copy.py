@@ -33,6 +33,7 @@ notes = [
     path('<int:client_id>/notes/add/', notes_views.add_case_note, name='note-add'),
     path('note/<int:casenote_id>/edit/', notes_views.editCaseNote, name='note-edit'),
     path('note/<int:casenote_id>/delete/', notes_views.deleteCaseNote, name='note-del'),
+    path('notes/class-session/', other_views.ClassSession.as_view(), name='class-session'),
 ]
 
 # Referral Views
@@ -44,6 +45,7 @@ referral = [
     path("referral/<int:pk>/edit/", referral_views.EditRefView.as_view(), name="edit_ref"),
     path("referral/<int:referral_id>/edit/save/", referral_views.edit_ref, name="edit_save_ref"),
     path("referral/<int:referral_id>/delete/", referral_views.delete_ref, name="delete_ref"),
+    path("referral/choices/", other_views.referral_options, name="referral-choices"),
     path("referral/<int:pk>/add-client/", referral_views.RefAddClient.as_view(), name="ref-add-client"),
     path("referral/<int:pk>/add-client/save/", referral_views.ref_save_client, name="ref-save-client"),
     path("referral/<int:pk>/delete-client/", referral_views.RefDelClient.as_view(), name="ref-del-client"),
@@ -64,12 +66,24 @@ print = [
 # Reporting
 reports = [
     path("report/attendance/", other_views.AttendanceReport.as_view(), name="attendance"),
+    path("report/attendance/export/", other_views.AttendanceReportExport.as_view(), name="attendance-export"),
+    path("report/monthly/", other_views.MonthlyReport.as_view(), name="monthly-report"),
+    path("report/analytics/", other_views.LedgerAnalytics.as_view(), name="analytics"),
+    path("report/requests/", other_views.RequestStats.as_view(), name="request-stats"),
+    path("metrics/", other_views.request_metrics, name="metrics"),
 ]
 
 # Search bar
 search = [
     path("advanced-search/", other_views.AdvancedSearch.as_view(), name="advanced-search"),
     path("advanced-search/results/", other_views.AdvancedSearchResults.as_view(), name="advanced-search-results"),
+    path("advanced-search/export/", other_views.AdvancedSearchExport.as_view(), name="advanced-search-export"),
+    path("advanced-search/typeahead/", other_views.typeahead, name="search-typeahead"),
+]
+
+# Bulk import
+imports = [
+    path("import/", other_views.ImportUpload.as_view(), name="import"),
 ]
 
 # User Profiles
@@ -87,5 +101,6 @@ urlpatterns = [
     search,
     user,
     reports,
+    imports,
 ]
 urlpatterns = [url for group in urlpatterns for url in group]
\ No newline at end of file